@@ -0,0 +1,256 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import click
+
+# Benchmark the checkout this script lives in, not an installed copy
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository_dir)
+
+from ncli.ncli import __version__
+from tests.startup_probe import importedModules, lazy_modules
+
+suites = ['startup', 'sync', 'download', 'wait']
+templates_bucket = 'nclouds-cloudformation-templates'
+bucket = 'ncli-benchmarks'
+region = 'us-east-1'
+# Timings within this many seconds of the baseline are never a regression, they are noise
+absolute_slack = 0.01
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-o', '--output', 'output', type=click.Path(dir_okay=False, writable=True), help="Write the results to this file instead of stdout")
+@click.option('-b', '--baseline', 'baseline', type=click.Path(exists=True, dir_okay=False), help="Results of a previous run to compare with, fails on regressions")
+@click.option('-t', '--tolerance', 'tolerance', default=0.25, show_default=True, help="Allowed slowdown over the baseline, as a fraction")
+@click.option('-r', '--repeat', 'repeat', default=5, show_default=True, help="Runs of every timing, the median is kept")
+@click.option('--sizes', 'sizes', default='10,100,1000', show_default=True, help="Comma separated number of templates of the sync trees")
+@click.option('--only', 'only', help="Comma separated suites to run ({})".format(', '.join(suites)))
+def main(output, baseline, tolerance, repeat, sizes, only):
+    """Benchmarks ncli offline, against moto instead of AWS
+
+    Measures the startup of `ncli --help` and `ncli cf info` (and checks that
+    they don't import boto3), `cf sync` of 10/100/1000 templates both cold and
+    without changes, `cf get-templates` and `cf init` downloads, and the API
+    calls of `create`/`update`/`delete --wait`. Needs moto: pip install -e .[bench]"""
+    selected = only.split(',') if only else suites
+    sizes = [int(size) for size in sizes.split(',')]
+    work_dir = tempfile.mkdtemp(prefix='ncli-bench-')
+    metrics = {}
+    failures = []
+    try:
+        # Startup runs ncli in new processes that never call AWS, so it doesn't need moto
+        if 'startup' in selected:
+            failures.extend(benchStartup(metrics, work_dir, repeat))
+        with _fakeAws(work_dir) if set(selected) - {'startup'} else _nothing():
+            if 'sync' in selected:
+                benchSync(metrics, work_dir, sizes)
+            if 'download' in selected:
+                benchDownload(metrics, work_dir, repeat)
+            if 'wait' in selected:
+                benchWait(metrics, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {
+        'ncli_version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'metrics': metrics,
+    }
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    else:
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
+
+    if baseline:
+        with open(baseline, 'r') as file:
+            failures.extend(compareResults(json.load(file)['metrics'], metrics, tolerance))
+    for failure in failures:
+        click.echo(click.style(failure, fg='red'), err=True)
+    if failures:
+        exit(1)
+
+def benchStartup(metrics, work_dir, repeat):
+    """Times ncli as a new process, returns the import budget violations"""
+    project = _createProject(os.path.join(work_dir, 'startup'), templates=0)
+    failures = []
+    for name, argv in [('startup_help', ['--help']), ('startup_cf_info', ['cf', 'info'])]:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'from ncli.daemon import main; main()'] + argv, cwd=project, env=_processEnv(),
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            timings.append(time.perf_counter() - started)
+        _metric(metrics, name + '_seconds', statistics.median(timings), 's')
+
+        modules = importedModules(argv, project)
+        _metric(metrics, name + '_modules', len(modules), 'modules')
+        for module in lazy_modules:
+            if module in modules:
+                failures.append('Import budget: `ncli {}` imports {}'.format(' '.join(argv), module))
+    return failures
+
+def benchSync(metrics, work_dir, sizes):
+    """Syncs trees of templates reachable from the master template, first to an empty prefix and then again without changes"""
+    for size in sizes:
+        project = _createProject(os.path.join(work_dir, 'sync-{}'.format(size)), templates=size, env='sync{}'.format(size))
+        for phase in ('cold', 'noop'):
+            seconds, trace = invoke(['cf', 'sync', '-e', 'sync{}'.format(size)], cwd=project)
+            name = 'sync_{}_{}'.format(size, phase)
+            _metric(metrics, name + '_seconds', seconds, 's')
+            _metric(metrics, name + '_api_calls', trace['total_api_calls'], 'calls')
+            _metric(metrics, name + '_bytes_sent', trace['bytes_sent'], 'bytes', compare=False)
+
+def benchDownload(metrics, work_dir, repeat, files=100, size=20 * 1024):
+    """Downloads templates and a sample project from the templates bucket, with a cold and a warm cache"""
+    import boto3
+    s3_client = boto3.client('s3', region_name=region)
+    s3_client.create_bucket(Bucket=templates_bucket, ObjectOwnership='ObjectWriter')
+    s3_client.delete_public_access_block(Bucket=templates_bucket)
+
+    def put(key, body):
+        s3_client.put_object(Bucket=templates_bucket, Key=key, Body=body, ACL='public-read')
+
+    body = 'Resources: {}\n' + '# padding\n' * (size // 10)
+    put('meta/templates.yml', ''.join('t{0}:\n  short-description: Template {0}\n  file: t{0}.yml\n  master-snippet: ""\n'.format(i) for i in range(files)))
+    put('meta/examples.yml', 'bench:\n  short-description: Benchmark sample project\n')
+    put('examples/bench/dev.json', '[{"ParameterKey": "S3BucketName", "ParameterValue": "x"}]')
+    for i in range(files):
+        put('templates/t{}.yml'.format(i), body)
+        put('examples/bench/templates/t{}.yml'.format(i), body)
+    total = files * len(body)
+
+    for phase in ('cold', 'warm'):
+        if phase == 'cold':
+            os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(dir=work_dir)
+        directory = tempfile.mkdtemp(dir=work_dir)
+        seconds, trace = invoke(['cf', 'get-templates', '-o'] + ['t{}'.format(i) for i in range(files)], cwd=directory)
+        _metric(metrics, 'get_templates_{}_seconds'.format(phase), seconds, 's')
+        _metric(metrics, 'get_templates_{}_api_calls'.format(phase), trace['total_api_calls'], 'calls')
+        _metric(metrics, 'get_templates_{}_throughput'.format(phase), total / seconds, 'bytes/s', compare=False)
+
+        directory = tempfile.mkdtemp(dir=work_dir)
+        seconds, trace = invoke(['cf', 'init', '--from', 'bench', '--stack-name', 'bench', '--bucket', bucket, '--region', region], cwd=directory)
+        _metric(metrics, 'init_{}_seconds'.format(phase), seconds, 's')
+        _metric(metrics, 'init_{}_api_calls'.format(phase), trace['total_api_calls'], 'calls')
+        _metric(metrics, 'init_{}_throughput'.format(phase), total / seconds, 'bytes/s', compare=False)
+
+def benchWait(metrics, work_dir):
+    """Counts the API calls of the create, update and delete flows that wait for the stack"""
+    project = _createProject(os.path.join(work_dir, 'wait'), templates=1, env='wait')
+    invoke(['cf', 'sync', '-e', 'wait'], cwd=project)
+    for name, argv, answer in [('create', ['cf', 'create', '--wait'], None), ('update', ['cf', 'update', '--wait', '--force'], None), ('delete', ['cf', 'delete', '--wait'], 'y\n')]:
+        seconds, trace = invoke(argv + ['-e', 'wait'], cwd=project, input=answer)
+        _metric(metrics, 'wait_{}_seconds'.format(name), seconds, 's')
+        _metric(metrics, 'wait_{}_api_calls'.format(name), trace['total_api_calls'], 'calls')
+
+def invoke(argv, cwd, input=None):
+    """Runs an ncli command in this process like a fresh invocation, returns its time and its trace summary"""
+    from click.testing import CliRunner
+    from ncli.ncli import ncli
+    from ncli.cloudformation import cf
+    from ncli.cloudformation import index, params
+
+    # Forget what a previous command left loaded, only the imports are shared
+    for cache in (cf.sessions, cf.clients, cf.yaml_files, cf.yaml_configs, index.parsed_templates, params.resolved):
+        cache.clear()
+
+    fd, trace_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    with _chdir(cwd):
+        started = time.perf_counter()
+        result = CliRunner().invoke(ncli, ['--trace', trace_path, '--trace-format', 'summary'] + argv, input=input)
+        seconds = time.perf_counter() - started
+    if result.exit_code != 0:
+        raise click.ClickException('ncli {} failed with exit code {}:\n{}'.format(' '.join(argv), result.exit_code, result.output))
+    with open(trace_path, 'r') as file:
+        trace = json.load(file)
+    os.remove(trace_path)
+    return seconds, trace
+
+def compareResults(baseline, metrics, tolerance):
+    """Returns a message for every metric that got worse than the baseline, timings beyond the
+    tolerance and counts (API calls, modules) by any amount"""
+    failures = []
+    for name, metric in sorted(metrics.items()):
+        previous = baseline.get(name)
+        if not metric['compare'] or previous is None:
+            continue
+        if metric['unit'] == 's':
+            regressed = metric['value'] > previous['value'] * (1 + tolerance) + absolute_slack
+        else:
+            regressed = metric['value'] > previous['value']
+        if regressed:
+            failures.append('Regression in {}: {:.4g} {} (baseline {:.4g})'.format(name, metric['value'], metric['unit'], previous['value']))
+    return failures
+
+# ############################### Helper Methods ###############################
+
+def _metric(metrics, name, value, unit, compare=True):
+    metrics[name] = {'value': value, 'unit': unit, 'compare': compare}
+
+def _createProject(directory, templates, env='dev'):
+    """Creates a project whose master template reaches every template through a nested stack"""
+    os.makedirs(os.path.join(directory, 'templates'))
+    with open(os.path.join(directory, '.config'), 'w') as file:
+        file.write('global:\n  stack_name: bench\n  bucket: {}\n  region: {}\n'.format(bucket, region))
+    with open(os.path.join(directory, 'master.yml'), 'w') as file:
+        file.write('Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n')
+        for i in range(templates):
+            file.write('  Nested{0}:\n    Type: AWS::CloudFormation::Stack\n    Properties:\n      TemplateURL: https://{1}.s3.amazonaws.com/bench/{2}/templates/t{0}.yml\n'.format(i, bucket, env))
+    for i in range(templates):
+        with open(os.path.join(directory, 'templates', 't{}.yml'.format(i)), 'w') as file:
+            file.write('Resources:\n  Queue:\n    Type: AWS::SQS::Queue\n    Properties:\n      QueueName: bench-{}\n'.format(i))
+    with open(os.path.join(directory, '{}.json'.format(env)), 'w') as file:
+        file.write('[]')
+    return directory
+
+def _processEnv():
+    return dict(os.environ, NCLI_NO_DAEMON='1', PYTHONPATH=repository_dir)
+
+@contextmanager
+def _fakeAws(work_dir):
+    """Points boto3 to moto, with fake credentials and nothing from the user's AWS config"""
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise click.ClickException('The benchmarks need moto, install it with: pip install -e .[bench]')
+
+    previous = dict(os.environ)
+    os.environ.update(AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark', AWS_DEFAULT_REGION=region,
+                      AWS_CONFIG_FILE=os.path.join(work_dir, 'aws-config'), AWS_SHARED_CREDENTIALS_FILE=os.path.join(work_dir, 'aws-credentials'),
+                      XDG_CACHE_HOME=os.path.join(work_dir, 'cache'), NCLI_NO_DAEMON='1')
+    os.environ.pop('AWS_PROFILE', None)
+    try:
+        with mock_aws():
+            import boto3
+            boto3.client('s3', region_name=region).create_bucket(Bucket=bucket)
+            yield
+    finally:
+        os.environ.clear()
+        os.environ.update(previous)
+
+@contextmanager
+def _nothing():
+    yield
+
+@contextmanager
+def _chdir(directory):
+    previous = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+
+def parseManifest(manifest, base_dir):
+    """Validates the manifest and returns its stacks by name
+
+    Every stack gets its location (relative to the manifest), the master template file name,
+    the parameters wired from the outputs of other stacks (parameter -> (stack, output)) and
+    its dependencies, the explicit ones plus the stacks whose outputs it uses.
+    """
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('stacks'), dict) or not manifest['stacks']:
+        raise ValueError('The manifest must have a "stacks" mapping')
+
+    stacks = {}
+    for name, stack in manifest['stacks'].items():
+        stack = stack or {}
+        if not isinstance(stack, dict):
+            raise ValueError('The stack {} must be a mapping'.format(name))
+        location = os.path.normpath(os.path.join(base_dir, str(stack.get('location', name))))
+        if not os.path.isfile(os.path.join(location, '.config')):
+            raise ValueError('The location of the stack {} ({}) has no .config file'.format(name, location))
+
+        wiring = {}
+        for parameter, source in (stack.get('parameters') or {}).items():
+            if not isinstance(source, str) or '.' not in source:
+                raise ValueError('The parameter {} of the stack {} must look like <stack>.<output>'.format(parameter, name))
+            wiring[parameter] = tuple(source.split('.', 1))
+
+        depends_on = stack.get('depends_on') or []
+        depends_on = [depends_on] if isinstance(depends_on, str) else list(depends_on)
+        for source, _ in wiring.values():
+            if source not in depends_on:
+                depends_on.append(source)
+        for dependency in depends_on:
+            if dependency not in manifest['stacks']:
+                raise ValueError('The stack {} depends on {}, which is not in the manifest'.format(name, dependency))
+
+        stacks[name] = {
+            'location': location,
+            'filename': stack.get('filename', 'master.yml'),
+            'parameters': wiring,
+            'depends_on': depends_on,
+        }
+    return stacks
+
+def executionOrder(stacks):
+    """Returns the stack names sorted so every stack comes after its dependencies, fails on cycles"""
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError('Dependency cycle: {}'.format(' -> '.join(path[path.index(name):] + [name])))
+        state[name] = 'visiting'
+        for dependency in stacks[name]['depends_on']:
+            visit(dependency, path + [name])
+        state[name] = 'done'
+        order.append(name)
+
+    for name in stacks:
+        visit(name, [])
+    return order
+
+def describeStacks(cf_client, stack_names):
+    """Returns the description of the stacks that exist by name
+
+    A single stack is described by name, several are taken from the paginated list of every
+    stack of the region so they cost one call per page instead of one per stack.
+    """
+    import botocore.exceptions
+    stack_names = set(stack_names)
+    if len(stack_names) == 1:
+        try:
+            stacks = cf_client.describe_stacks(StackName=list(stack_names)[0])['Stacks']
+        except botocore.exceptions.ClientError as ex:
+            if 'does not exist' in str(ex):
+                return {}
+            raise
+    else:
+        stacks = [stack for page in cf_client.get_paginator('describe_stacks').paginate() for stack in page['Stacks']]
+    return dict((stack['StackName'], stack) for stack in stacks if stack['StackName'] in stack_names)
+
+def stackOutputs(stack):
+    return dict((output['OutputKey'], output['OutputValue']) for output in stack.get('Outputs') or [])
+
+def wiredParameters(wiring, outputs):
+    """Returns the values of the wired parameters from the outputs of the stacks they come from"""
+    values = {}
+    for parameter, (source, output) in wiring.items():
+        if output not in outputs.get(source, {}):
+            raise ValueError('The stack {} has no output {} for the parameter {}'.format(source, output, parameter))
+        values[parameter] = outputs[source][output]
+    return values
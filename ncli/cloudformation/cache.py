@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+index_file = 'index.json'
+# Per project state (sync manifest, template index...) lives next to the templates so each checkout keeps its own
+state_dir = '.ncli'
+
+class CacheMiss(Exception):
+    pass
+
+def userCacheDir(*parts):
+    """Returns a directory inside the ncli user cache dir"""
+    if os.environ.get('XDG_CACHE_HOME'):
+        base = os.environ['XDG_CACHE_HOME']
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    elif os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.path.expanduser('~/.cache')
+    return os.path.join(base, 'ncli', *parts)
+
+def projectStateDir(location, *parts):
+    """Returns a path inside the state directory of the project"""
+    return os.path.join(location, state_dir, *parts)
+
+class ObjectCache(object):
+    """On disk cache of the objects of a S3 bucket
+
+    Objects are served from disk while they are younger than the TTL, after that they are
+    revalidated with a conditional GET on their ETag. The least recently used objects are
+    evicted when the cache grows over max_size bytes. In offline mode nothing is requested
+    and missing objects raise CacheMiss. The S3 client is only created (and botocore imported)
+    when something has to be requested.
+    """
+
+    def __init__(self, client_factory, bucket, directory, ttl=3600, max_size=100 * 1024 * 1024, offline=False):
+        self.client_factory = client_factory
+        self._client = None
+        self.bucket = bucket
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.index = loadJson(os.path.join(directory, index_file), {})
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                self._client = self.client_factory()
+            return self._client
+
+    def get(self, key):
+        """Returns the content of the object"""
+        name = self.bucket + '/' + key
+        body = self._cached(name)
+        if body is not None:
+            return body
+
+        import botocore.exceptions
+        entry = self.index.get(name)
+        arguments = {'Bucket': self.bucket, 'Key': key}
+        if entry is not None and os.path.isfile(self._path(name)):
+            arguments['IfNoneMatch'] = entry['etag']
+        try:
+            response = self.client.get_object(**arguments)
+        except botocore.exceptions.ClientError as ex:
+            if 'IfNoneMatch' in arguments and ex.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                with self.lock:
+                    entry['fetched'] = time.time()
+                return self._read(name)
+            raise
+
+        body = response['Body'].read()
+        self._store(name, response.get('ETag', ''), body)
+        return body
+
+    def list(self, prefix):
+        """Returns the keys of the objects under the prefix"""
+        name = 'list:{}/{}'.format(self.bucket, prefix)
+        body = self._cached(name)
+        if body is not None:
+            return json.loads(body.decode('utf-8'))
+
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        self._store(name, '', json.dumps(keys).encode('utf-8'))
+        return keys
+
+    def save(self):
+        """Writes the index of the cache and evicts the least recently used objects"""
+        with self.lock:
+            total = sum(entry['size'] for entry in self.index.values())
+            for name, entry in sorted(self.index.items(), key=lambda item: item[1]['accessed']):
+                if total <= self.max_size:
+                    break
+                total -= entry['size']
+                del self.index[name]
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+            saveJson(os.path.join(self.directory, index_file), self.index)
+
+    def _cached(self, name):
+        """Returns the cached content while it's fresh (or always when offline)"""
+        entry = self.index.get(name)
+        if entry is None or not os.path.isfile(self._path(name)):
+            if self.offline:
+                raise CacheMiss('{} is not available offline'.format(name))
+            return None
+        if self.offline or time.time() - entry['fetched'] < self.ttl:
+            return self._read(name)
+        return None
+
+    def _read(self, name):
+        with self.lock:
+            self.index[name]['accessed'] = time.time()
+        with open(self._path(name), 'rb') as file:
+            return file.read()
+
+    def _store(self, name, etag, body):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as file:
+            file.write(body)
+        os.replace(temp_path, self._path(name))
+        now = time.time()
+        with self.lock:
+            self.index[name] = {'etag': etag, 'size': len(body), 'fetched': now, 'accessed': now}
+
+    def _path(self, name):
+        return os.path.join(self.directory, hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+def loadJson(path, default):
+    """Returns the content of a JSON file, or the default when it's missing or invalid"""
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return default
+
+def saveJson(path, data, **options):
+    """Writes a JSON file atomically, readers never see it half written. The options go to json.dump"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(data, file, **options)
+    os.replace(temp_path, path)
@@ -1,54 +1,77 @@
 import click
 import functools
-import boto3
 import yaml
 import json
 import subprocess
-import botocore.exceptions
 import os.path
-import pyperclip
-from botocore import UNSIGNED
-from botocore.client import Config
+import sys
+import threading
+import time
 
 from .colors import colors
+from ..trace import span
 import textwrap
 
+# boto3, botocore and pyperclip are imported inside the commands that need them,
+# they take a few hundred milliseconds to load and most invocations don't use them
+
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 # Constants
 templates_bucket = 'nclouds-cloudformation-templates'
-session = {}
+# Sessions, clients and parsed config files live as long as the process, which is
+# a single command usually but many of them in the `ncli serve` daemon
+sessions = {}
+clients = {}
+sessions_lock = threading.RLock()
+# Modification times of the AWS config files the cached sessions were created with
+aws_files_stamp = None
+yaml_files = {}
 yaml_configs = {}
 
 def common_params(func):
     @click.option('--region', 'region', help="AWS region")
     @click.option('--profile', 'profile', help="AWS profile name")
-    @click.option('-e', '--environment', 'env', default='dev', show_default=True, help="The environment for the stack")
+    @click.option('-e', '--environment', 'env', default='dev', show_default=True, help="The environment for the stack, commands that accept --regions also take a comma separated list")
     @click.argument('location', default='.', type=click.Path(exists=True))
     @click.argument('extra-args', nargs=-1)
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        global session
-        global yaml_configs 
+        global yaml_configs
 
         yaml_configs = _loadYamlFile(kwargs['location'] + '/' + '.config')
-        kwargs['base_stack_name'] = _getConfiguration('stack_name', kwargs['env'])
-        kwargs['stack_name'] = '{}-{}'.format(kwargs['base_stack_name'], kwargs['env'], required=True)
-        kwargs['region'] = kwargs['region'] or _getConfiguration('region', kwargs['env'], required=True)
-        kwargs['profile'] = kwargs['profile'] or _getConfiguration('profile', kwargs['env'])
-        kwargs['bucket'] = _getConfiguration('bucket', kwargs['env'], required=True)
-        kwargs['key_prefix'] = (_getConfiguration('key_prefix', kwargs['env'], required=False) or kwargs['base_stack_name']) + '/' + kwargs['env']
-        kwargs['parameters'] = _getConfiguration('parameters_file', kwargs['env']) or '{}.json'.format(kwargs['env'])
-        kwargs['multi_region'] = _getConfiguration('multi_region', kwargs['env'])
-        if kwargs['multi_region'] == True:
-            kwargs['bucket'] += '-' + kwargs['region']
-
         kwargs['extra_args'] = list(kwargs['extra_args'])
 
-        session = boto3.session.Session(region_name=kwargs['region'], profile_name=kwargs['profile'])
+        regions = kwargs.pop('regions', None)
+        regions = regions.split(',') if regions else [kwargs['region']]
+        targets = [_resolveTarget(dict(kwargs, env=env, region=region)) for env in kwargs['env'].split(',') for region in regions]
+        if len(targets) > 1 and not getattr(func, 'multi_target', False):
+            click.echo(click.style('This command only accepts one environment and region', fg='red'))
+            exit(1)
+
+        kwargs = dict(targets[0], targets=targets)
         return func(*args, **kwargs)
     return wrapper
 
+def cache_params(func):
+    @click.option('--offline', 'offline', is_flag=True, help="Use only the local copy of the nClouds repository")
+    @click.option('--cache-ttl', 'cache_ttl', default=3600, show_default=True, envvar='NCLI_CACHE_TTL', help="Seconds before the local copy of the nClouds repository is revalidated")
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        repository = _getRepository(kwargs.pop('offline'), kwargs.pop('cache_ttl'))
+        try:
+            return func(*args, repository=repository, **kwargs)
+        finally:
+            repository.save()
+    return wrapper
+
+def multi_target(func):
+    """Lets a command run against several environments/regions, use it below @common_params"""
+    func = click.option('-P', '--parallel', 'parallel', default=4, show_default=True, help="Number of environments/regions to run at the same time")(func)
+    func = click.option('--regions', 'regions', help="Comma separated list of AWS regions, overrides --region")(func)
+    func.multi_target = True
+    return func
+
 @click.group()
 @click.pass_context
 def cf(ctx):
@@ -58,67 +81,142 @@ def cf(ctx):
 
 @cf.command()
 @common_params
+@multi_target
+@click.option('--engine', 'engine', type=click.Choice(['native', 'cli']), default='native', show_default=True, help="Upload with boto3 or run the AWS CLI")
+@click.option('-j', '--jobs', 'jobs', default=10, show_default=True, help="Number of concurrent uploads")
+@click.option('--full', 'full', is_flag=True, help="Upload every template, ignoring the sync manifest")
+@click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
+@click.option('-a', '--all', 'all_templates', is_flag=True, help="Upload every *.yml file, not only the templates reachable from the master template")
+@click.option('--package', 'package', is_flag=True, help="Package the local code of the templates first and upload the packaged templates")
 # @click.pass_obj
 def sync(**kwargs):
     """Sync CloudFormation templates to S3 bucket"""
+    _runTargets(kwargs, _syncTarget)
 
-    command = ['aws', 's3', 'sync', kwargs['location'], 's3://{bucket}/{key}'.format(bucket=kwargs['bucket'], key=kwargs['key_prefix']) ,'--exclude', '*', '--include', '*.yml', '--acl', 'bucket-owner-full-control']
+def _syncTarget(kwargs):
+    command = ['aws', 's3', 'sync', kwargs['location'], 's3://{bucket}/{key}'.format(bucket=kwargs['bucket'], key=kwargs['key_prefix']) ,'--exclude', '*', '--include', '*.yml', '--exclude', '.ncli/*', '--acl', 'bucket-owner-full-control']
 
     _printInfo(Bucket=kwargs['bucket'], Key=kwargs['key_prefix'])
-    _executeAwsCliCommand(command, kwargs)
+    if kwargs['engine'] == 'cli' or kwargs['extra_args']:
+        if kwargs['package']:
+            click.echo(click.style('--package only works with the native engine and without extra args', fg='red'))
+            exit(1)
+        # Extra args are raw `aws s3 sync` arguments, only the AWS CLI understands them
+        _executeAwsCliCommand(command, kwargs)
+        return
+
+    from botocore.client import Config
+    from .s3sync import syncTemplates
+    files = None if kwargs['all_templates'] else _syncedTemplates(kwargs['location'], kwargs['filename'])
+    s3_client = _getClient('s3', kwargs['region'], kwargs['profile'], config=Config(max_pool_connections=max(kwargs['jobs'], 10)))
+    bodies = _packageTarget(kwargs, s3_client, files) if kwargs['package'] else None
+    if syncTemplates(s3_client, kwargs['location'], kwargs['bucket'], kwargs['key_prefix'], jobs=kwargs['jobs'], full=kwargs['full'], files=files, bodies=bodies):
+        exit(1)
+
+def _packageTarget(kwargs, s3_client, files=None):
+    """Uploads the local code of the templates, returns the packaged templates by the path of the original ones"""
+    from .s3sync import findTemplates
+    from .package import packageTemplates, packagedDir
+    location = kwargs['location']
+    if files is None:
+        files = [os.path.relpath(path, location).replace(os.sep, '/') for path in findTemplates(location)]
+    try:
+        return packageTemplates(s3_client, location, files, kwargs['bucket'], kwargs['key_prefix'], packagedDir(location, kwargs['env'], kwargs['region']), jobs=kwargs['jobs'])
+    except Exception as ex:
+        click.echo(click.style('Unable to package the templates: {}'.format(ex), fg='red'))
+        exit(1)
+
+def _syncedTemplates(location, filename, action='syncing'):
+    """Returns the templates reachable from the master template, or None (every template) when the graph is incomplete"""
+    from .index import reachableTemplates
+    if not os.path.isfile(os.path.join(location, filename)):
+        return None
+    templates, unresolved = reachableTemplates(location, filename)
+    if unresolved:
+        click.echo(click.style('Some nested templates couldn\'t be found locally, {} every template'.format(action), fg='yellow'))
+        for item in unresolved:
+            click.echo(click.style('  ' + item, fg='yellow'))
+        return None
+    return templates
+
+@cf.command()
+@common_params
+@multi_target
+@click.option('-j', '--jobs', 'jobs', default=10, show_default=True, help="Number of concurrent zips and uploads")
+@click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
+@click.option('-a', '--all', 'all_templates', is_flag=True, help="Package every *.yml file, not only the templates reachable from the master template")
+def package(**kwargs):
+    """Upload the local code referenced by the templates"""
+    _runTargets(kwargs, _packageTemplates)
+
+def _packageTemplates(kwargs):
+    from botocore.client import Config
+    _printInfo(Bucket=kwargs['bucket'], Key=kwargs['key_prefix'])
+    files = None if kwargs['all_templates'] else _syncedTemplates(kwargs['location'], kwargs['filename'])
+    s3_client = _getClient('s3', kwargs['region'], kwargs['profile'], config=Config(max_pool_connections=max(kwargs['jobs'], 10)))
+    packaged = _packageTarget(kwargs, s3_client, files)
+    for relpath in sorted(packaged):
+        click.echo('{} -> {}'.format(relpath, packaged[relpath]))
+    if not packaged:
+        click.echo(click.style('No template references local code', fg='blue'))
 
 @cf.command()
 @common_params
+@multi_target
 @click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
 @click.option('-w', '--wait', 'wait', is_flag=True, help="Wait until the operation finishes")
+@click.option('--engine', 'engine', type=click.Choice(['native', 'cli']), default='native', show_default=True, help="Call CloudFormation with boto3 or run the AWS CLI")
 def create(**kwargs):
     """Create CloudFormation Stack"""
+    _runTargets(kwargs, _createStack)
 
-    command = ['aws', 'cloudformation', 'create-stack', '--stack-name', kwargs['stack_name'], '--template-body', 'file://{}/{}'.format(kwargs['location'], kwargs['filename']), '--parameters', 'file://{}/{}'.format(kwargs['location'], kwargs['parameters']), '--capabilities', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
+def _createStack(kwargs):
+    command = ['aws', 'cloudformation', 'create-stack', '--stack-name', kwargs['stack_name'], '--template-body', 'file://' + _templateFile(kwargs), '--parameters', 'file://{}/{}'.format(kwargs['location'], kwargs['parameters']), '--capabilities', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
 
     _printInfo(Stack=kwargs['stack_name'], Environment=kwargs['env'], Region=kwargs['region'], Bucket=kwargs['bucket'])
-    _executeAwsCliCommand(command, kwargs)
+    _executeStackCommand('create', command, kwargs)
+    _storeFingerprint(kwargs, _stackFingerprint(kwargs))
 
     if kwargs['wait']:
-        cf_client = session.client('cloudformation')
-        waiter = cf_client.get_waiter('stack_create_complete')
-        try:
-            click.echo(click.style('Waiting for the Stack creation to finish...', fg='blue'))
-            waiter.wait(
-                StackName=kwargs['stack_name'],
-            )
-            click.echo(click.style('Stack created successfully', fg='green'))
-        except botocore.exceptions.WaiterError as ex:
-            click.echo(click.style('The Stack creation failed' , fg='red'))
+        _waitForStack('create', _stackWatcher(kwargs))
 
 @cf.command()
 @common_params
+@multi_target
 @click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
 @click.option('-w', '--wait', 'wait', is_flag=True, help="Wait until the operation finishes")
+@click.option('--engine', 'engine', type=click.Choice(['native', 'cli']), default='native', show_default=True, help="Call CloudFormation with boto3 or run the AWS CLI")
+@click.option('--force', 'force', is_flag=True, help="Update the stack even if the templates and parameters didn't change")
 def update(**kwargs):
     """Update CloudFormation Stack"""
+    _runTargets(kwargs, _updateStack)
 
-    command = ['aws', 'cloudformation', 'update-stack', '--stack-name', kwargs['stack_name'], '--template-body', 'file://{}/{}'.format(kwargs['location'], kwargs['filename']), '--parameters', 'file://{}/{}'.format(kwargs['location'], kwargs['parameters']), '--capabilities', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
+def _updateStack(kwargs):
+    command = ['aws', 'cloudformation', 'update-stack', '--stack-name', kwargs['stack_name'], '--template-body', 'file://' + _templateFile(kwargs), '--parameters', 'file://{}/{}'.format(kwargs['location'], kwargs['parameters']), '--capabilities', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
 
     _printInfo(Stack=kwargs['stack_name'], Environment=kwargs['env'], Region=kwargs['region'], Bucket=kwargs['bucket'])
-    _executeAwsCliCommand(command, kwargs)
-
-    if kwargs['wait']:
-        cf_client = session.client('cloudformation')
-        waiter = cf_client.get_waiter('stack_update_complete')
-
-        try:
-            click.echo(click.style('Waiting for the Stack update to finish...', fg='blue'))
-            waiter.wait(
-                StackName=kwargs['stack_name'],
-            )
-            click.echo(click.style('Stack updated successfully', fg='green'))
-        except botocore.exceptions.WaiterError as ex:
-            click.echo(click.style('The Stack update failed' , fg='red'))
+    if kwargs['engine'] == 'cli':
+        # Before fingerprinting, which resolves the references
+        _refuseCliReferences(kwargs)
+    fingerprint = _stackFingerprint(kwargs)
+    if fingerprint is not None and not kwargs['force'] and _isStackUnchanged(kwargs, fingerprint):
+        click.echo(click.style('The templates and parameters didn\'t change since the last update, use --force to update anyway', fg='green'))
+        return False
+
+    watcher = _stackWatcher(kwargs, mark=True) if kwargs['wait'] else None
+    # A stack without a stored fingerprint (created before fingerprints, or deployed by other tools) may
+    # have nothing to update, that's success and its fingerprint is stored so the next update is skipped
+    updated = _executeStackCommand('update', command, dict(kwargs, no_updates_ok=True)) is not False
+    _storeFingerprint(kwargs, fingerprint)
+
+    if kwargs['wait'] and updated:
+        _waitForStack('update', watcher)
+    return updated
 
 @cf.command()
 @common_params
 @click.option('-w', '--wait', 'wait', is_flag=True, help="Wait until the operation finishes")
+@click.option('--engine', 'engine', type=click.Choice(['native', 'cli']), default='native', show_default=True, help="Call CloudFormation with boto3 or run the AWS CLI")
 def delete(**kwargs):
     """Delete CloudFormation Stack"""
 
@@ -126,21 +224,69 @@ def delete(**kwargs):
 
     if click.confirm(click.style('Are you sure you want to delete the stack: {} in {}'.format(kwargs['stack_name'], kwargs['region']), fg='yellow')):
         _printInfo(Stack=kwargs['stack_name'], Environment=kwargs['env'], Region=kwargs['region'], Bucket=kwargs['bucket'])
-        _executeAwsCliCommand(command, kwargs)
+        watcher = _stackWatcher(kwargs, mark=True) if kwargs['wait'] else None
+        _executeStackCommand('delete', command, kwargs)
         click.echo(click.style('The stack is being deleted', fg='blue'))
 
         if kwargs['wait']:
-            cf_client = session.client('cloudformation')
-            waiter = cf_client.get_waiter('stack_delete_complete')
+            _waitForStack('delete', watcher)
+
+@cf.command(short_help='Deploy several stacks in dependency order')
+@click.option('--region', 'region', help="AWS region, overrides the one of every stack")
+@click.option('--profile', 'profile', help="AWS profile name, overrides the one of every stack")
+@click.option('-e', '--environment', 'env', default='dev', show_default=True, help="The environment for the stacks")
+@click.option('-P', '--parallel', 'parallel', default=8, show_default=True, help="Number of stacks to deploy at the same time")
+@click.option('--force', 'force', is_flag=True, help="Update the stacks even if their templates and parameters didn't change")
+@click.argument('manifest', default='stacks.yml', type=click.Path(exists=True))
+def apply(manifest, env, region, profile, parallel, force):
+    """Create or update the stacks of a manifest in dependency order,
+    wiring the outputs of some stacks into the parameters of others
+
+    Stacks that don't depend on each other are deployed at the same time.
+    When a stack fails the stacks that depend on it are skipped, the rest
+    keep going."""
+    from .apply import parseManifest, executionOrder, stackOutputs, wiredParameters
+    from .fanout import runGraph, printSummary
 
-            try:
-                click.echo(click.style('Waiting for the Stack deletion to finish...', fg='blue'))
-                waiter.wait(
-                    StackName=kwargs['stack_name'],
-                )
-                click.echo(click.style('Stack deleted successfully', fg='green'))
-            except botocore.exceptions.WaiterError as ex:
-                click.echo(click.style('Stack deletion failed' , fg='red'))
+    try:
+        stacks = parseManifest(_loadYamlFile(manifest), os.path.dirname(manifest) or '.')
+        order = executionOrder(stacks)
+    except ValueError as ex:
+        click.echo(click.style(str(ex), fg='red'))
+        exit(1)
+
+    targets = {}
+    for name in order:
+        stack = stacks[name]
+        target = dict(manifest_name=name, location=stack['location'], filename=stack['filename'], env=env, region=region, profile=profile,
+                      extra_args=[], engine='native', wait=True, force=force, no_updates_ok=True)
+        targets[name] = _resolveTarget(target, configs=_loadYamlFile(stack['location'] + '/.config'))
+
+    click.echo(click.style('Deploying {}'.format(', '.join('{} ({})'.format(name, targets[name]['stack_name']) for name in order)), fg='blue'))
+    existing = _describeTargets(targets.values())
+    # Outputs by manifest name, only of the stacks other stacks take parameters from
+    sources = set(source for stack in stacks.values() for source, _ in stack['parameters'].values())
+    outputs = {}
+
+    def deploy(target):
+        name = target['manifest_name']
+        target['parameter_overrides'] = wiredParameters(stacks[name]['parameters'], outputs)
+        stack = existing.get((target['region'], target['profile'], target['stack_name']))
+        if stack is None or stack['StackStatus'] == 'REVIEW_IN_PROGRESS':
+            _createStack(target)
+            changed = True
+        else:
+            changed = _updateStack(target)
+
+        if name in sources:
+            if changed:
+                stack = _describeTargets([target]).get((target['region'], target['profile'], target['stack_name']), {})
+            outputs[name] = stackOutputs(stack)
+
+    results = runGraph(targets, dict((name, stacks[name]['depends_on']) for name in order), deploy, parallel=parallel)
+    printSummary(results)
+    if any(result['error'] for result in results):
+        exit(1)
 
 @cf.command()
 @common_params
@@ -149,14 +295,141 @@ def info(**kwargs):
     """Print settings used by the CLI"""
     _printInfo(Stack=kwargs['stack_name'], Environment=kwargs['env'], Region=kwargs['region'], Bucket=kwargs['bucket'], Key=kwargs['key_prefix'])
 
+@cf.command()
+@common_params
+@multi_target
+@click.option('-j', '--jobs', 'jobs', default=10, show_default=True, help="Number of concurrent requests")
+@click.option('--rate', 'rate', default=5.0, show_default=True, help="Maximum number of drift detections started per second")
+def drift(**kwargs):
+    """Detect the drift of the stack and its nested stacks"""
+    _runTargets(kwargs, _detectDrift)
+
+def _detectDrift(kwargs):
+    import botocore.exceptions
+    from botocore.client import Config
+    from .drift import DriftDetector
+
+    _printInfo(Stack=kwargs['stack_name'], Environment=kwargs['env'], Region=kwargs['region'])
+    cf_client = _getClient('cloudformation', kwargs['region'], kwargs['profile'], config=Config(max_pool_connections=max(kwargs['jobs'] * 2, 10)))
+    started = time.time()
+    try:
+        results = DriftDetector(cf_client, kwargs['stack_name'], rate=kwargs['rate'], jobs=kwargs['jobs']).detect()
+    except botocore.exceptions.ClientError as ex:
+        click.echo(click.style(str(ex), fg='red'), err=True)
+        exit(1)
+
+    drifted = len([status for status in results.values() if status == 'DRIFTED'])
+    failed = len([status for status in results.values() if status == 'FAILED'])
+    click.echo(click.style('{} stacks checked in {:.1f}s, {} drifted, {} failed'.format(len(results), time.time() - started, drifted, failed), fg='red' if drifted or failed else 'green'))
+    if drifted or failed:
+        exit(1)
+
+@cf.command()
+@click.option('--region', 'region', help="AWS region, overrides the one of every environment")
+@click.option('--regions', 'regions', help="Comma separated list of AWS regions, overrides --region")
+@click.option('--profile', 'profile', help="AWS profile name")
+@click.option('--json', 'as_json', is_flag=True, help="Print the stacks as JSON")
+@click.option('--cache-ttl', 'cache_ttl', default=5, show_default=True, help="Seconds the last result is reused for, 0 to always describe the stacks")
+@click.argument('location', default='.', type=click.Path(exists=True))
+def status(location, region, regions, profile, as_json, cache_ttl):
+    """Print the status of the stack of every environment"""
+    from .status import cachedRows, printStatus, statusRows, storeRows
+
+    configs = _loadYamlFile(location + '/' + '.config')
+    envs = [env for env in configs if env != 'global'] or ['dev']
+    regions = regions.split(',') if regions else [region]
+    targets = [_resolveTarget(dict(location=location, env=env, region=region, profile=profile), configs=configs) for env in envs for region in regions]
+
+    rows = cachedRows(targets, cache_ttl) if cache_ttl > 0 else None
+    if rows is None:
+        import botocore.exceptions
+        try:
+            rows = statusRows(targets, _describeTargets(targets))
+        except botocore.exceptions.ClientError as ex:
+            click.echo(click.style(str(ex), fg='red'), err=True)
+            exit(1)
+        storeRows(targets, rows)
+
+    if as_json:
+        click.echo(json.dumps(rows, indent=2))
+    else:
+        printStatus(rows)
+
+@cf.command()
+@common_params
+@click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
+@click.option('-r', '--remote', 'remote', is_flag=True, help="Also validate the templates with the CloudFormation ValidateTemplate API")
+@click.option('-j', '--jobs', 'jobs', type=int, help="Number of processes for the local checks and concurrent remote validations  [default: number of CPUs]")
+@click.option('-a', '--all', 'all_templates', is_flag=True, help="Validate every *.yml file, not only the templates reachable from the master template")
+def validate(**kwargs):
+    """Validate the templates before deploying them"""
+    from .s3sync import findTemplates
+    from .validate import checkTemplates, checkParameters
+
+    location = kwargs['location']
+    # Other yml files (CI workflows, the cf apply manifest...) aren't templates
+    relpaths = None if kwargs['all_templates'] else _syncedTemplates(location, kwargs['filename'], action='validating')
+    if relpaths is None:
+        relpaths = [os.path.relpath(path, location).replace(os.sep, '/') for path in findTemplates(location)]
+    cf_client = _getClient('cloudformation', kwargs['region'], kwargs['profile']) if kwargs['remote'] else None
+    results, cached = checkTemplates(location, relpaths, jobs=kwargs['jobs'], cf_client=cf_client)
+
+    parameters_file = location + '/' + kwargs['parameters']
+    if kwargs['filename'] in results and os.path.isfile(parameters_file):
+        issues = checkParameters(results[kwargs['filename']]['parameters'], _loadJsonFile(parameters_file))
+        results[kwargs['parameters']] = {'issues': issues}
+
+    counts = {'error': 0, 'warning': 0}
+    for relpath in sorted(results):
+        issues = results[relpath]['issues']
+        if issues:
+            click.echo(relpath)
+        for level, message in issues:
+            counts[level] += 1
+            click.echo('  ' + click.style(level + ':', fg='red' if level == 'error' else 'yellow') + ' ' + message)
+
+    click.echo(click.style('{} templates checked ({} cached), {} errors, {} warnings'.format(len(relpaths), cached, counts['error'], counts['warning']), fg='red' if counts['error'] else 'green'))
+    if counts['error']:
+        exit(1)
+
+@cf.command()
+@click.option('-f', '--filename', 'filename', default='master.yml', show_default=True, help="File name of the master template")
+@click.option('--json', 'as_json', is_flag=True, help="Print the graph as JSON")
+@click.argument('location', default='.', type=click.Path(exists=True))
+def graph(location, filename, as_json):
+    """Print the nested stacks graph of the master template"""
+    from .index import TemplateIndex
+    index = TemplateIndex(location)
+    try:
+        nodes, unresolved = index.graph(filename)
+    except Exception as ex:
+        click.echo(click.style('Unable to index the templates: {}'.format(ex), fg='red'))
+        exit(1)
+    index.save()
+
+    if as_json:
+        click.echo(json.dumps({'templates': nodes, 'unresolved': unresolved}, indent=2))
+        return
+
+    def printNode(relpath, prefix, last, parents):
+        connector = '' if not parents else ('└── ' if last else '├── ')
+        click.echo(prefix + connector + relpath + (click.style(' (cycle)', fg='red') if relpath in parents else ''))
+        if relpath in parents:
+            return
+        children = nodes.get(relpath, [])
+        for i, child in enumerate(children):
+            printNode(child, prefix + ('' if not parents else ('    ' if last else '│   ')), i == len(children) - 1, parents + [relpath])
+
+    printNode(filename, '', True, [])
+    for item in unresolved:
+        click.echo(click.style('Unresolved TemplateURL: ' + item, fg='yellow'))
+
 @cf.command("list-templates", short_help='List available templates')
-def list_templates(**kwargs):
+@cache_params
+def list_templates(repository, **kwargs):
     """List available templates from the nClouds CloudFormation repository"""
-    s3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-    bucket = s3.Bucket(templates_bucket)
-
     try:
-        templates_metadata = yaml.safe_load(bucket.Object('meta/templates.yml').get()['Body'].read())
+        templates_metadata = yaml.safe_load(repository.get('meta/templates.yml'))
         click.echo(click.style('Available templates:' , fg='blue'))
 
         for key, template in templates_metadata.items():
@@ -166,13 +439,11 @@ def list_templates(**kwargs):
         click.echo(click.style('Templates are not available at this moment' , fg='yellow'))
 
 @cf.command("list-examples", short_help='List available examples')
-def list_examples(**kwargs):
+@cache_params
+def list_examples(repository, **kwargs):
     """List available examples from the nClouds CloudFormation repository"""
-    s3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-    bucket = s3.Bucket(templates_bucket)
-
     try:
-        examples_metadata = yaml.safe_load(bucket.Object('meta/examples.yml').get()['Body'].read())
+        examples_metadata = yaml.safe_load(repository.get('meta/examples.yml'))
         click.echo(click.style('Available examples:' , fg='blue'))
 
         for key, template in examples_metadata.items():
@@ -184,39 +455,37 @@ def list_examples(**kwargs):
 @cf.command("get-templates", short_help='Download templates from repository')
 @click.option('-s', '--snippet', 'snippet', is_flag=True, help="Copy master stack snippet to the clipboard")
 @click.option('-o', '--overwrite', 'overwrite', is_flag=True, help="Overwrite template if it already exists")
+@click.option('-j', '--jobs', 'jobs', default=10, show_default=True, help="Number of concurrent downloads")
 @click.argument('templates', nargs=-1)
-def get_templates(templates, snippet, overwrite):
+@cache_params
+def get_templates(templates, snippet, overwrite, jobs, repository):
     """Download templates from the nClouds CloudFormation repository"""
-    s3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-    bucket = s3.Bucket(templates_bucket)
+    import botocore.exceptions
+    from .cache import CacheMiss
+    from .transfer import bulkDownload
 
     try:
-        templates_metadata = yaml.safe_load(bucket.Object('meta/templates.yml').get()['Body'].read())
+        templates_metadata = yaml.safe_load(repository.get('meta/templates.yml'))
         click.echo(click.style('Downloading templates...' , fg='blue'))
 
         if not os.path.exists('templates'):
             os.makedirs('templates')
 
         master_snippet = ''
+        items = []
         for template in templates:
-            obj = bucket.Object('templates/' + templates_metadata[template]['file'])
-            if os.path.isfile(obj.key) and overwrite:
-                obj.download_file(obj.key)
-                click.echo(obj.key + " overwritten")
-            elif os.path.isfile(obj.key):
-                click.echo(obj.key + " skipped")
-            else:
-                obj.download_file(obj.key)
-                click.echo(obj.key + " created")
-
+            key = 'templates/' + templates_metadata[template]['file']
+            items.append((key, key))
             master_snippet += templates_metadata[template]['master-snippet']
+        bulkDownload(items, repository.get, overwrite=overwrite, jobs=jobs)
         
         if snippet:
+            import pyperclip
             pyperclip.copy(master_snippet)
             click.echo(click.style('Master template snippet copied to clipboard!' , fg='green'))
     except KeyError as ex:
         click.echo(click.style('The template {} doesn\'t exist in nClouds CloudFormation repository'.format(template) , fg='red'))
-    except botocore.exceptions.ClientError as ex:
+    except (botocore.exceptions.ClientError, CacheMiss) as ex:
         click.echo(click.style('Templates are not available at this moment' , fg='yellow'))
     except Exception as ex:
         print(ex)
@@ -227,11 +496,13 @@ def get_templates(templates, snippet, overwrite):
 @click.option('--stack-name', 'stack_name', prompt="Enter the Stack name for the project", help="Stack name for the project")
 @click.option('--bucket', 'bucket_name', prompt="Enter the S3 bucket name for the templates", help="S3 bucket name for the templates")
 @click.option('--region', 'region', prompt="Enter the AWS region for the CloudFormation Stack", help="AWS region for the CloudFormation Stack")
-def init(from_project, stack_name, bucket_name, region):
+@click.option('-j', '--jobs', 'jobs', default=10, show_default=True, help="Number of concurrent downloads")
+@cache_params
+def init(from_project, stack_name, bucket_name, region, jobs, repository):
     """Initialize a new project within the current directory by creating a .config file,
     optionally initialize project using a nClouds sample project"""
-    s3 = boto3.resource('s3', config=Config(signature_version=UNSIGNED))
-    bucket = s3.Bucket(templates_bucket)
+    import botocore.exceptions
+    from .cache import CacheMiss
 
     if os.path.isfile('.config'):
         click.echo(click.style('The current project is already initialized' , fg='red'))
@@ -248,12 +519,12 @@ def init(from_project, stack_name, bucket_name, region):
     if from_project != 'None':
          # TODO create a metadata file in the repository with the available examples
         try:
-            templates_metadata = yaml.safe_load(bucket.Object('meta/examples.yml').get()['Body'].read())
+            templates_metadata = yaml.safe_load(repository.get('meta/examples.yml'))
             if from_project.lower() not in templates_metadata:
                 click.echo(click.style('The example {} doesn\'t exists in nClouds sample projects repostory'.format(from_project) , fg='red'))
                 exit(1)
             click.echo(click.style('Initializing project with \'{}\' sample ...'.format(from_project), fg='blue'))
-        except botocore.exceptions.ClientError as ex:
+        except (botocore.exceptions.ClientError, CacheMiss) as ex:
             click.echo(click.style('Templates are not available at this moment' , fg='yellow'))
     else:
         click.echo(click.style('Initializing project with config file', fg='blue'))
@@ -266,17 +537,9 @@ def init(from_project, stack_name, bucket_name, region):
 
     if from_project != 'None':
         # Download sample files
-        for obj_summary in bucket.objects.filter(Prefix='examples/' + from_project.lower()):
-            local_key = obj_summary.key.replace("examples/" + from_project.lower() + "/", "")
-            path, filename = os.path.split(local_key)        
-            obj = bucket.Object(obj_summary.key)
-
-            if path != '':
-                if not os.path.exists(path):
-                    os.makedirs(path)
-            obj.download_file(local_key)
-
-            click.echo(local_key + " created")
+        from .transfer import bulkDownload
+        keys = repository.list('examples/' + from_project.lower())
+        bulkDownload([(key, key.replace("examples/" + from_project.lower() + "/", "")) for key in keys], repository.get, overwrite=True, jobs=jobs)
         # Change bucket name in parameters file
         with open("dev.json", "r+") as jsonFile:
             data = json.load(jsonFile)
@@ -304,11 +567,122 @@ def _printInfo(nl=True, **kwargs):
     message += colors['NORMAL'] + ('\n' if nl == True else '')
     click.echo(message)
 
+def _resolveTarget(kwargs, configs=None):
+    """Resolves the settings of the stack for the environment and region in kwargs, from the
+    given .config content or the one of the command location"""
+    kwargs['base_stack_name'] = _getConfiguration('stack_name', kwargs['env'], configs=configs)
+    kwargs['stack_name'] = '{}-{}'.format(kwargs['base_stack_name'], kwargs['env'], required=True)
+    kwargs['region'] = kwargs['region'] or _getConfiguration('region', kwargs['env'], required=True, configs=configs)
+    kwargs['profile'] = kwargs['profile'] or _getConfiguration('profile', kwargs['env'], configs=configs)
+    kwargs['bucket'] = _getConfiguration('bucket', kwargs['env'], required=True, configs=configs)
+    kwargs['key_prefix'] = (_getConfiguration('key_prefix', kwargs['env'], required=False, configs=configs) or kwargs['base_stack_name']) + '/' + kwargs['env']
+    kwargs['parameters'] = _getConfiguration('parameters_file', kwargs['env'], configs=configs) or '{}.json'.format(kwargs['env'])
+    kwargs['multi_region'] = _getConfiguration('multi_region', kwargs['env'], configs=configs)
+    if kwargs['multi_region'] == True:
+        kwargs['bucket'] += '-' + kwargs['region']
+        kwargs['parameters'] = '{}-{}{}'.format(os.path.splitext(kwargs['parameters'])[0], kwargs['region'], os.path.splitext(kwargs['parameters'])[1])
+    return kwargs
+
+def _runTargets(kwargs, action):
+    """Runs the action for the target, or for all of them concurrently when the command got several"""
+    if len(kwargs['targets']) == 1:
+        return action(kwargs)
+
+    from .fanout import runTargets, printSummary
+    results = runTargets(kwargs['targets'], action, parallel=kwargs['parallel'])
+    printSummary(results)
+    if any(result['error'] for result in results):
+        exit(1)
+
+def _describeTargets(targets):
+    """Describes the stacks of the targets with one batch of calls per region and profile,
+    returns the stacks that exist by (region, profile, stack name)"""
+    from concurrent.futures import ThreadPoolExecutor
+    from .apply import describeStacks
+    groups = {}
+    for target in targets:
+        groups.setdefault((target['region'], target['profile']), []).append(target['stack_name'])
+
+    def describe(group):
+        return describeStacks(_getClient('cloudformation', group[0], group[1]), groups[group])
+
+    with ThreadPoolExecutor(max_workers=max(1, len(groups))) as executor:
+        described = dict(zip(groups, executor.map(describe, groups)))
+    return dict(((region, profile, name), stack) for (region, profile), stacks in described.items() for name, stack in stacks.items())
+
+def _getSession(profile=None):
+    """Returns the boto3 session of the profile, creating it on first use with the
+    persistent credential cache for assume role profiles. Every region of a profile uses the same session and
+    credentials, so a role is assumed (and the MFA code asked) once even when several targets start at the same time"""
+    global aws_files_stamp
+    with sessions_lock:
+        # Rotated keys, new profiles or an `aws sso login` need new sessions (the daemon keeps them otherwise)
+        stamp = _awsFilesStamp()
+        if stamp != aws_files_stamp:
+            sessions.clear()
+            clients.clear()
+            aws_files_stamp = stamp
+        if profile not in sessions:
+            with span('create session', profile=profile):
+                import boto3
+                from ..trace import instrumentSession
+                from .credcache import installCache
+                session = boto3.session.Session(profile_name=profile)
+                instrumentSession(session)
+                installCache(session)
+                sessions[profile] = session
+        return sessions[profile]
+
+def _awsFilesStamp():
+    """Returns the modification time and size of the AWS config and credentials files and of the SSO token cache"""
+    paths = [
+        os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config')),
+        os.path.expanduser(os.environ.get('AWS_SHARED_CREDENTIALS_FILE', '~/.aws/credentials')),
+        os.path.expanduser(os.path.join('~', '.aws', 'sso', 'cache')),
+    ]
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def _getClient(service, region=None, profile=None, **kwargs):
+    """Creates a client from the cached session of the profile, botocore doesn't allow creating clients concurrently.
+    Clients without extra arguments are cached"""
+    with sessions_lock:
+        session = _getSession(profile)
+        if kwargs:
+            with span('create client', service=service, region=region):
+                return session.client(service, region_name=region, **kwargs)
+        if (service, region, profile) not in clients:
+            with span('create client', service=service, region=region):
+                clients[(service, region, profile)] = session.client(service, region_name=region)
+        return clients[(service, region, profile)]
+
+def _getRepository(offline=False, ttl=3600):
+    """Returns the local cache of the nClouds CloudFormation repository bucket, accessed anonymously"""
+    from .cache import ObjectCache, userCacheDir
+
+    def client_factory():
+        from botocore import UNSIGNED
+        from botocore.client import Config
+        return _getClient('s3', config=Config(signature_version=UNSIGNED))
+
+    return ObjectCache(client_factory, templates_bucket, userCacheDir('repository'), ttl=ttl, offline=offline)
+
 def _loadYamlFile(file_name):
-    """Parses yaml files and returns its content"""
+    """Parses yaml files and returns its content, cached while the file doesn't change"""
     try:
-        with open(file_name, "r") as file:
+        stat = os.stat(file_name)
+        cached = yaml_files.get(os.path.abspath(file_name))
+        if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+        with span('load yaml', file=file_name), open(file_name, "r") as file:
             yaml_file = yaml.safe_load(file.read())
+            yaml_files[os.path.abspath(file_name)] = ((stat.st_mtime_ns, stat.st_size), yaml_file)
             return yaml_file
     except Exception as ex:
         click.echo(click.style('Invalid {} yaml file'.format(file_name), fg='red'))
@@ -326,8 +700,9 @@ def _loadJsonFile(file_name):
         print(ex)
         exit(1)
 
-def _getConfiguration(property, env, required=False):
-    config = yaml_configs.get(env, {}).get(property) or yaml_configs.get('global', {}).get(property)
+def _getConfiguration(property, env, required=False, configs=None):
+    configs = yaml_configs if configs is None else configs
+    config = configs.get(env, {}).get(property) or configs.get('global', {}).get(property)
     if required == True and config == None:
         click.echo(click.style('"{}" missing in config file'.format(property), fg='red'))
         exit(1)
@@ -340,9 +715,157 @@ def _executeAwsCliCommand(command, kwargs):
     final_command = command + ([ '--region', kwargs['region'] ] if kwargs['region'] != None else []) + ([ '--profile', kwargs['profile'] ] if kwargs['profile'] != None else []) + kwargs['extra_args']
     _executeShellCommand(final_command)
 
+def _loadParameters(kwargs):
+    """Loads the parameters file of the stack, with the values wired by `cf apply` on top and the
+    SSM and Secrets Manager references resolved"""
+    import botocore.exceptions
+    from .params import UnresolvedReferences, resolveParameters
+    overrides = kwargs.get('parameter_overrides') or {}
+    file_name = kwargs['location'] + '/' + kwargs['parameters']
+    parameters = _loadJsonFile(file_name) if os.path.isfile(file_name) or not overrides else []
+    parameters = [parameter for parameter in parameters if parameter.get('ParameterKey') not in overrides]
+    parameters.extend({'ParameterKey': key, 'ParameterValue': value} for key, value in sorted(overrides.items()))
+
+    try:
+        return resolveParameters(parameters, lambda service: _getClient(service, kwargs['region'], kwargs['profile']), kwargs['region'], kwargs['profile'])
+    except UnresolvedReferences as ex:
+        click.echo(click.style('Some references of {} don\'t exist:'.format(kwargs['parameters']), fg='red'), err=True)
+        for kind, name in ex.references:
+            click.echo(click.style('  {{{{{}:{}}}}}'.format(kind, name), fg='red'), err=True)
+        exit(1)
+    except botocore.exceptions.ClientError as ex:
+        click.echo(click.style('Unable to resolve the references of {}: {}'.format(kwargs['parameters'], ex), fg='red'), err=True)
+        exit(1)
+
+def _stackFingerprint(kwargs):
+    """Returns the fingerprint of the templates and parameters of the stack, None if it can't be computed
+    or if the nested templates in the bucket aren't the local ones (CloudFormation reads those)"""
+    from .fingerprint import stackFingerprint
+    from .index import reachableTemplates
+    from .package import packagedDir
+    from .s3sync import unsyncedTemplates
+    parameters = _loadParameters(kwargs)
+    packaged_dir = packagedDir(kwargs['location'], kwargs['env'], kwargs['region'])
+    try:
+        templates, _ = reachableTemplates(kwargs['location'], kwargs['filename'])
+        nested = [relpath for relpath in templates if relpath != kwargs['filename']]
+        unsynced = unsyncedTemplates(kwargs['location'], nested, kwargs['bucket'], kwargs['key_prefix'], packaged_dir)
+        if unsynced:
+            click.echo(click.style('Some nested templates changed since the last sync to s3://{}/{}, run `ncli cf sync` to deploy them'.format(kwargs['bucket'], kwargs['key_prefix']), fg='yellow'))
+            for relpath in unsynced:
+                click.echo(click.style('  ' + relpath, fg='yellow'))
+            return None
+        return stackFingerprint(kwargs['location'], kwargs['filename'], parameters, kwargs['extra_args'], packaged_dir)
+    except Exception as ex:
+        click.echo(click.style('Unable to fingerprint the templates: {}'.format(ex), fg='yellow'))
+        return None
+
+def _isStackUnchanged(kwargs, fingerprint):
+    from .fingerprint import fingerprintKey, isUnchanged
+    s3_client = _getClient('s3', kwargs['region'], kwargs['profile'])
+    cf_client = _getClient('cloudformation', kwargs['region'], kwargs['profile'])
+    return isUnchanged(s3_client, cf_client, kwargs['bucket'], fingerprintKey(kwargs['key_prefix'], kwargs['region']), kwargs['stack_name'], fingerprint)
+
+def _storeFingerprint(kwargs, fingerprint):
+    """Stores the fingerprint next to the templates in the bucket, so unchanged stacks can skip the next update"""
+    if fingerprint is None:
+        return
+    import botocore.exceptions
+    from .fingerprint import fingerprintKey, storeFingerprint
+    try:
+        storeFingerprint(_getClient('s3', kwargs['region'], kwargs['profile']), kwargs['bucket'], fingerprintKey(kwargs['key_prefix'], kwargs['region']), kwargs['stack_name'], fingerprint)
+    except botocore.exceptions.ClientError as ex:
+        click.echo(click.style('Unable to store the stack fingerprint: {}'.format(ex), fg='yellow'))
+
+def _stackWatcher(kwargs, mark=False):
+    """Creates the event watcher for the stack, marking the current position of its events when it already exists"""
+    from .events import StackWatcher
+    watcher = StackWatcher(_getClient('cloudformation', kwargs['region'], kwargs['profile']), kwargs['stack_name'])
+    if mark:
+        watcher.mark()
+    return watcher
+
+def _waitForStack(operation, watcher):
+    """Streams the stack events until the operation finishes, exits with 1 if it didn't succeed"""
+    from .events import success_statuses
+    messages = {
+        'create': ('Waiting for the Stack creation to finish...', 'Stack created successfully', 'The Stack creation failed'),
+        'update': ('Waiting for the Stack update to finish...', 'Stack updated successfully', 'The Stack update failed'),
+        'delete': ('Waiting for the Stack deletion to finish...', 'Stack deleted successfully', 'Stack deletion failed'),
+    }[operation]
+
+    click.echo(click.style(messages[0], fg='blue'))
+    status = watcher.watch()
+    if status == success_statuses[operation]:
+        click.echo(click.style(messages[1], fg='green'))
+    else:
+        click.echo(click.style('{} ({})'.format(messages[2], status), fg='red'))
+        exit(1)
+
+def _executeStackCommand(operation, command, kwargs):
+    """Runs the stack operation with boto3, falling back to the AWS CLI command when the native engine can't handle it.
+    Returns False when the stack had nothing to update and no_updates_ok is set (always by update)"""
+    if kwargs['engine'] == 'native':
+        import botocore.exceptions
+        from . import engine
+        try:
+            arguments = engine.stackArguments(operation, kwargs['extra_args'])
+        except (ValueError, IOError) as ex:
+            click.echo(click.style('{}, falling back to the AWS CLI'.format(ex), fg='yellow'))
+        else:
+            template_body = None
+            parameters = None
+            if operation != 'delete':
+                try:
+                    with open(_templateFile(kwargs), 'r') as file:
+                        template_body = file.read()
+                except IOError as ex:
+                    click.echo(click.style('Unable to read the template {}: {}'.format(_templateFile(kwargs), ex.strerror), fg='red'), err=True)
+                    exit(1)
+                parameters = _loadParameters(kwargs)
+
+            cf_client = _getClient('cloudformation', kwargs['region'], kwargs['profile'])
+            try:
+                response = engine.stackCall(cf_client, operation, kwargs['stack_name'], template_body, parameters, capabilities=['CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND'], arguments=arguments)
+            except botocore.exceptions.ClientError as ex:
+                if kwargs.get('no_updates_ok') and 'No updates are to be performed' in str(ex):
+                    click.echo(click.style('The stack is up to date', fg='green'))
+                    return False
+                click.echo(click.style(str(ex), fg='red'), err=True)
+                exit(1)
+            if 'StackId' in response:
+                click.echo(json.dumps({'StackId': response['StackId']}, indent=4))
+            return True
+
+    if operation != 'delete':
+        _refuseCliReferences(kwargs)
+    _executeAwsCliCommand(command, kwargs)
+
+def _templateFile(kwargs):
+    """Returns the path of the master template to deploy, its packaged version when it has local code"""
+    from .package import packagedDir
+    packaged = os.path.join(packagedDir(kwargs['location'], kwargs['env'], kwargs['region']), kwargs['filename'])
+    return packaged if os.path.isfile(packaged) else kwargs['location'] + '/' + kwargs['filename']
+
+def _refuseCliReferences(kwargs):
+    """Exits when the parameters file has SSM or Secrets Manager references, the AWS CLI would send them as they are"""
+    if os.path.isfile(kwargs['location'] + '/' + kwargs['parameters']):
+        from .params import parameterReferences
+        if parameterReferences(_loadJsonFile(kwargs['location'] + '/' + kwargs['parameters'])):
+            click.echo(click.style('{} has SSM or Secrets Manager references, they are only resolved by the native engine'.format(kwargs['parameters']), fg='red'), err=True)
+            exit(1)
+
 def _executeShellCommand(command):
-    process = subprocess.Popen(command, universal_newlines=True)
-    process.communicate()[0]
+    with span('aws cli', command=' '.join(command[:3])):
+        if sys.stdout is sys.__stdout__:
+            process = subprocess.Popen(command, universal_newlines=True)
+            process.communicate()[0]
+        else:
+            # Output is being redirected (eg. prefixed per target), so it has to go through python
+            process = subprocess.Popen(command, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            for line in process.stdout:
+                click.echo(line, nl=False)
+            process.wait()
     if process.returncode != 0:
         exit(1)
 
@@ -356,75 +879,3 @@ def _executeShellCommand(command):
     #             # click.echo(output.strip())
     #             pass
     #         break
-
-
-
-
-
-class SafeUnknownConstructor(yaml.constructor.SafeConstructor):
-    def __init__(self):
-        yaml.constructor.SafeConstructor.__init__(self)
-
-    def construct_undefined(self, node):
-        data = getattr(self, 'construct_' + node.id)(node)
-        datatype = type(data)
-        wraptype = type('TagWrap_'+datatype.__name__, (datatype,), {})
-        wrapdata = wraptype(data)
-        wrapdata.tag = lambda: None
-        wrapdata.datatype = lambda: None
-        setattr(wrapdata, "wrapTag", node.tag)
-        setattr(wrapdata, "wrapType", datatype)
-        return wrapdata
-
-
-class SafeUnknownLoader(SafeUnknownConstructor, yaml.loader.SafeLoader):
-
-    def __init__(self, stream):
-        SafeUnknownConstructor.__init__(self)
-        yaml.loader.SafeLoader.__init__(self, stream)
-
-
-class SafeUnknownRepresenter(yaml.representer.SafeRepresenter):
-    def represent_data(self, wrapdata):
-        tag = False
-        if type(wrapdata).__name__.startswith('TagWrap_'):
-            datatype = getattr(wrapdata, "wrapType")
-            tag = getattr(wrapdata, "wrapTag")
-            data = datatype(wrapdata)
-        else:
-            data = wrapdata
-        node = super(SafeUnknownRepresenter, self).represent_data(data)
-        if tag:
-            node.tag = tag
-        return node
-
-class SafeUnknownDumper(SafeUnknownRepresenter, yaml.dumper.SafeDumper):
-
-    def __init__(self, stream,
-            default_style=None, default_flow_style=False,
-            canonical=None, indent=None, width=None,
-            allow_unicode=None, line_break=None,
-            encoding=None, explicit_start=None, explicit_end=None,
-            version=None, tags=None, sort_keys=True):
-
-        SafeUnknownRepresenter.__init__(self, default_style=default_style,
-                default_flow_style=default_flow_style, sort_keys=sort_keys)
-
-        yaml.dumper.SafeDumper.__init__(self,  stream,
-                                        default_style=default_style,
-                                        default_flow_style=default_flow_style,
-                                        canonical=canonical,
-                                        indent=indent,
-                                        width=width,
-                                        allow_unicode=allow_unicode,
-                                        line_break=line_break,
-                                        encoding=encoding,
-                                        explicit_start=explicit_start,
-                                        explicit_end=explicit_end,
-                                        version=version,
-                                        tags=tags,
-                                        sort_keys=sort_keys)
-
-
-MySafeLoader = SafeUnknownLoader
-yaml.constructor.SafeConstructor.add_constructor(None, SafeUnknownConstructor.construct_undefined)
\ No newline at end of file
@@ -0,0 +1,169 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .cache import userCacheDir
+
+# Providers whose temporary credentials can be cached, with botocore's method names
+cached_providers = ['assume-role', 'assume-role-with-web-identity', 'sso']
+key_file = 'key'
+# Service and user name of the key in the OS keyring
+keyring_service = 'ncli'
+keyring_user = 'credential-cache-key'
+lock_file = '.lock'
+# Cached credentials that expire sooner than this are fetched again, the same window botocore uses
+refresh_window = 15 * 60
+
+class CredentialCache(object):
+    """Encrypted file cache of the temporary credentials of a profile
+
+    It's the dict like cache botocore's credential providers expect. Every entry is a file
+    encrypted with a key that is created on first use and kept in the OS keyring when the
+    keyring package has a working backend. Otherwise the key is a file next to the entries, only
+    readable by the user, which is just obfuscation: the file permissions are the protection.
+    Writes are atomic and a lock file keeps concurrent ncli processes from reading half created keys.
+    Entries that are about to expire are reported as missing so the credentials are refreshed
+    before they stop working.
+    """
+
+    def __init__(self, directory, profile):
+        from cryptography.fernet import Fernet
+        self.directory = directory
+        self.profile = profile or 'default'
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.fernet = Fernet(self._loadKey())
+
+    def __contains__(self, cache_key):
+        try:
+            self[cache_key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, cache_key):
+        from cryptography.fernet import InvalidToken
+        try:
+            with self._lock(exclusive=False):
+                with open(self._path(cache_key), 'rb') as file:
+                    token = file.read()
+            value = json.loads(self.fernet.decrypt(token).decode('utf-8'))
+        except (IOError, ValueError, InvalidToken):
+            raise KeyError(cache_key)
+        if _expiresSoon(value):
+            raise KeyError(cache_key)
+        return value
+
+    def __setitem__(self, cache_key, value):
+        token = self.fernet.encrypt(json.dumps(value, default=_serialize).encode('utf-8'))
+        with self._lock(exclusive=True):
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(token)
+            os.replace(temp_path, self._path(cache_key))
+
+    def __delitem__(self, cache_key):
+        with self._lock(exclusive=True):
+            try:
+                os.remove(self._path(cache_key))
+            except OSError:
+                raise KeyError(cache_key)
+
+    def _path(self, cache_key):
+        # botocore keys already hash the role arn, session name and MFA serial
+        return os.path.join(self.directory, hashlib.sha256('{}\0{}'.format(self.profile, cache_key).encode('utf-8')).hexdigest() + '.bin')
+
+    def _loadKey(self):
+        from cryptography.fernet import Fernet
+        path = os.path.join(self.directory, key_file)
+        with self._lock(exclusive=True):
+            key = _keyringKey(Fernet)
+            if key is not None:
+                return key
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            except FileExistsError:
+                with open(path, 'rb') as file:
+                    return file.read()
+            key = Fernet.generate_key()
+            with os.fdopen(fd, 'wb') as file:
+                file.write(key)
+            return key
+
+    @contextmanager
+    def _lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, lock_file), 'a') as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def installCache(session):
+    """Makes the assume role (MFA included), web identity and SSO credentials of the boto3 session
+    persist between runs. Does nothing when cryptography isn't installed (credentials are never
+    stored unencrypted) or when NCLI_NO_CREDENTIAL_CACHE is set"""
+    if os.environ.get('NCLI_NO_CREDENTIAL_CACHE'):
+        return False
+    # Profiles with static credentials have nothing to cache, don't pay for importing cryptography
+    config = session._session.full_config.get('profiles', {}).get(session.profile_name) or {}
+    if not any(key in config for key in ('role_arn', 'web_identity_token_file', 'sso_session', 'sso_start_url')):
+        return False
+    try:
+        cache = CredentialCache(userCacheDir('credentials'), session.profile_name)
+    except ImportError:
+        return False
+
+    from botocore.exceptions import UnknownCredentialError
+    resolver = session._session.get_component('credential_provider')
+    for name in cached_providers:
+        try:
+            resolver.get_provider(name).cache = cache
+        except UnknownCredentialError:
+            pass
+    return True
+
+# ############################### Helper Methods ###############################
+
+def _keyringKey(fernet_class):
+    """Returns the key stored in the OS keyring, creating it on first use, or None when there's no usable keyring"""
+    try:
+        import keyring
+    except ImportError:
+        return None
+    try:
+        key = keyring.get_password(keyring_service, keyring_user)
+        if key is None:
+            key = fernet_class.generate_key().decode('ascii')
+            keyring.set_password(keyring_service, keyring_user, key)
+    except Exception:
+        # No backend (eg. a headless Linux without Secret Service) or a locked keyring, use the key file
+        return None
+    return key.encode('ascii')
+
+def _serialize(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+def _expiresSoon(value):
+    expiration = value.get('Credentials', {}).get('Expiration') if isinstance(value, dict) else None
+    if not isinstance(expiration, str):
+        return False
+    try:
+        expiration = datetime.datetime.fromisoformat(expiration.replace('Z', '+00:00'))
+    except ValueError:
+        return False
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=datetime.timezone.utc)
+    return (expiration - datetime.datetime.now(datetime.timezone.utc)).total_seconds() < refresh_window
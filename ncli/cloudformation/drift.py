@@ -0,0 +1,145 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+
+class RateLimiter(object):
+    """Lets at most rate calls per second through, shared by every thread"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+class DriftDetector(object):
+    """Detects the drift of a stack and every nested stack under it
+
+    The detections are started concurrently (at most rate per second), and all the running
+    detections are polled together with a single interval that grows while none of them
+    finishes. The drifted resources of every stack are printed as soon as its detection ends.
+    """
+
+    def __init__(self, cf_client, stack_name, rate=5, jobs=10, min_delay=2, max_delay=20):
+        self.cf_client = cf_client
+        self.stack_name = stack_name
+        self.limiter = RateLimiter(rate)
+        self.jobs = jobs
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+    def nestedStacks(self):
+        """Returns the id of the stack and of every nested stack under it, parents first"""
+        root = self.cf_client.describe_stacks(StackName=self.stack_name)['Stacks'][0]['StackId']
+        stacks = [root]
+        level = [root]
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while level:
+                level = [child for children in executor.map(self._childStacks, level) for child in children if child not in stacks]
+                stacks.extend(level)
+        return stacks
+
+    def detect(self):
+        """Runs the detections and prints the drifted resources, returns the drift status by stack name"""
+        import botocore.exceptions
+        stacks = self.nestedStacks()
+        click.echo(click.style('Detecting the drift of {} stacks...'.format(len(stacks)), fg='blue'))
+
+        results = {}
+        pending = {}
+        delay = self.min_delay
+        with ThreadPoolExecutor(max_workers=self.jobs) as starter, ThreadPoolExecutor(max_workers=self.jobs) as poller:
+            starts = dict((starter.submit(self._start, stack_id), stack_id) for stack_id in stacks)
+            while starts or pending:
+                if pending:
+                    time.sleep(delay)
+                else:
+                    wait(list(starts), return_when=FIRST_COMPLETED)
+
+                for future in [future for future in starts if future.done()]:
+                    stack_id = starts.pop(future)
+                    try:
+                        pending[future.result()] = stack_id
+                    except botocore.exceptions.ClientError as ex:
+                        results[stackName(stack_id)] = 'FAILED'
+                        click.echo(click.style('{}: unable to start the drift detection ({})'.format(stackName(stack_id), ex), fg='red'))
+
+                detection_ids = list(pending)
+                finished = False
+                throttled = False
+                for detection_id, response in zip(detection_ids, poller.map(self._status, detection_ids)):
+                    if response is None:
+                        throttled = True
+                    elif response['DetectionStatus'] != 'DETECTION_IN_PROGRESS':
+                        finished = True
+                        stack_id = pending.pop(detection_id)
+                        results[stackName(stack_id)] = self._report(stack_id, response)
+                delay = self.max_delay if throttled else self.min_delay if finished else min(delay * 1.5, self.max_delay)
+        return results
+
+    def _childStacks(self, stack_id):
+        children = []
+        for page in self.cf_client.get_paginator('list_stack_resources').paginate(StackName=stack_id):
+            for resource in page['StackResourceSummaries']:
+                if resource['ResourceType'] == 'AWS::CloudFormation::Stack' and resource.get('PhysicalResourceId', '').startswith('arn:'):
+                    children.append(resource['PhysicalResourceId'])
+        return children
+
+    def _start(self, stack_id):
+        """Starts the detection, retrying while throttled, and returns its id"""
+        import botocore.exceptions
+        delay = self.min_delay
+        while True:
+            self.limiter.wait()
+            try:
+                return self.cf_client.detect_stack_drift(StackName=stack_id)['StackDriftDetectionId']
+            except botocore.exceptions.ClientError as ex:
+                if 'Throttling' not in str(ex) or delay > self.max_delay:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def _status(self, detection_id):
+        """Returns the status of the detection, or None when throttled"""
+        import botocore.exceptions
+        try:
+            return self.cf_client.describe_stack_drift_detection_status(StackDriftDetectionId=detection_id)
+        except botocore.exceptions.ClientError as ex:
+            if 'Throttling' not in str(ex):
+                raise
+            return None
+
+    def _report(self, stack_id, response):
+        """Prints the drift of a stack whose detection finished and returns its drift status"""
+        name = stackName(stack_id)
+        if response['DetectionStatus'] == 'DETECTION_FAILED' and response.get('StackDriftStatus') not in ('DRIFTED', 'IN_SYNC'):
+            click.echo(click.style('{}: the drift detection failed ({})'.format(name, response.get('DetectionStatusReason', '')), fg='red'))
+            return 'FAILED'
+
+        status = response.get('StackDriftStatus', 'UNKNOWN')
+        if status != 'DRIFTED':
+            click.echo('{}: {}'.format(name, click.style(status, fg='green' if status == 'IN_SYNC' else 'yellow')))
+            return status
+
+        click.echo('{}: {} ({} resources)'.format(name, click.style(status, fg='red'), response.get('DriftedStackResourceCount', '?')))
+        pages = self.cf_client.get_paginator('describe_stack_resource_drifts').paginate(StackName=stack_id, StackResourceDriftStatusFilters=['MODIFIED', 'DELETED'])
+        for page in pages:
+            for drift in page['StackResourceDrifts']:
+                click.echo('  {} ({}) {}'.format(drift['LogicalResourceId'], click.style(drift['ResourceType'], fg='cyan'), click.style(drift['StackResourceDriftStatus'], fg='red')))
+                for difference in drift.get('PropertyDifferences', []):
+                    click.echo('    {}  {}: expected {} actual {}'.format(difference['DifferenceType'].ljust(9), difference['PropertyPath'], difference['ExpectedValue'], difference['ActualValue']))
+        if response['DetectionStatus'] == 'DETECTION_FAILED':
+            click.echo(click.style('  Some resources couldn\'t be checked ({})'.format(response.get('DetectionStatusReason', '')), fg='yellow'))
+        return status
+
+def stackName(stack_id):
+    """Returns the name of a stack from its id (arn:aws:cloudformation:<region>:<account>:stack/<name>/<uuid>)"""
+    return stack_id.split('/')[1] if stack_id.startswith('arn:') else stack_id
@@ -0,0 +1,99 @@
+import json
+
+# aws cli options understood by the native engine for each operation, mapped to their API argument
+stack_options = {
+    'create': {
+        '--role-arn': 'RoleARN',
+        '--tags': 'Tags',
+        '--capabilities': 'Capabilities',
+        '--notification-arns': 'NotificationARNs',
+        '--timeout-in-minutes': 'TimeoutInMinutes',
+        '--on-failure': 'OnFailure',
+        '--disable-rollback': 'DisableRollback',
+        '--no-disable-rollback': 'DisableRollback',
+        '--enable-termination-protection': 'EnableTerminationProtection',
+        '--no-enable-termination-protection': 'EnableTerminationProtection',
+    },
+    'update': {
+        '--role-arn': 'RoleARN',
+        '--tags': 'Tags',
+        '--capabilities': 'Capabilities',
+        '--notification-arns': 'NotificationARNs',
+        '--disable-rollback': 'DisableRollback',
+        '--no-disable-rollback': 'DisableRollback',
+    },
+    'delete': {
+        '--role-arn': 'RoleARN',
+        '--retain-resources': 'RetainResources',
+    },
+}
+list_arguments = ['Tags', 'Capabilities', 'NotificationARNs', 'RetainResources']
+
+class UnsupportedArgument(ValueError):
+    pass
+
+def stackArguments(operation, extra_args):
+    """Translates aws cli style extra args into keyword arguments for the CloudFormation API"""
+    options = stack_options[operation]
+    arguments = {}
+    option = None
+    values = []
+    for arg in list(extra_args) + ['--']:
+        if arg.startswith('--'):
+            if option is not None:
+                arguments[options[option]] = _convertValues(option, options[option], values)
+            option, _, value = arg.partition('=')
+            values = [value] if value else []
+            if option == '--':
+                break
+            if option not in options:
+                raise UnsupportedArgument('The {} argument is not supported by the native engine'.format(option))
+        elif option is None:
+            raise UnsupportedArgument('Unexpected argument {}'.format(arg))
+        else:
+            values.append(arg)
+    return arguments
+
+def stackCall(cf_client, operation, stack_name, template_body=None, parameters=None, capabilities=None, arguments=None):
+    """Runs the create/update/delete stack call and returns the response"""
+    api_kwargs = {'StackName': stack_name}
+    if operation != 'delete':
+        api_kwargs['TemplateBody'] = template_body
+        api_kwargs['Parameters'] = parameters or []
+        api_kwargs['Capabilities'] = capabilities or []
+    api_kwargs.update(arguments or {})
+    return getattr(cf_client, operation + '_stack')(**api_kwargs)
+
+# ############################### Helper Methods ###############################
+
+def _convertValues(option, name, values):
+    if option.startswith('--no-'):
+        return False
+    if name in ['DisableRollback', 'EnableTerminationProtection']:
+        return True
+    if not values:
+        raise UnsupportedArgument('The {} argument expects a value'.format(option))
+
+    if len(values) == 1 and values[0].startswith('file://'):
+        with open(values[0][len('file://'):], 'r') as file:
+            values = [file.read()]
+    if len(values) == 1 and values[0].lstrip().startswith(('[', '{')):
+        return json.loads(values[0])
+
+    if name == 'Tags':
+        return [_parseShorthand(value) for value in values]
+    if name == 'TimeoutInMinutes':
+        return int(values[0])
+    if name in list_arguments:
+        return values
+    return values[0]
+
+def _parseShorthand(value):
+    """Parses Key=string,Value=string items"""
+    item = {}
+    for pair in value.split(','):
+        key, separator, content = pair.partition('=')
+        if not separator:
+            raise UnsupportedArgument('Invalid shorthand value {}'.format(value))
+        item[key.strip()] = content
+    return item
@@ -0,0 +1,131 @@
+import time
+
+import click
+
+from ..trace import span
+
+# Statuses after which a stack doesn't emit any more events for the current operation
+terminal_statuses = [
+    'CREATE_COMPLETE', 'CREATE_FAILED', 'ROLLBACK_COMPLETE', 'ROLLBACK_FAILED',
+    'UPDATE_COMPLETE', 'UPDATE_FAILED', 'UPDATE_ROLLBACK_COMPLETE', 'UPDATE_ROLLBACK_FAILED',
+    'DELETE_COMPLETE', 'DELETE_FAILED',
+    'IMPORT_COMPLETE', 'IMPORT_ROLLBACK_COMPLETE', 'IMPORT_ROLLBACK_FAILED',
+]
+success_statuses = {
+    'create': 'CREATE_COMPLETE',
+    'update': 'UPDATE_COMPLETE',
+    'delete': 'DELETE_COMPLETE',
+}
+
+class StackWatcher(object):
+    """Streams the events of a stack and its nested stacks until the stack reaches a terminal status
+
+    DescribeStackEvents is paged only until the last event already seen, and the polling
+    interval grows while nothing happens and drops back as soon as new events show up
+    """
+
+    def __init__(self, cf_client, stack_name, min_delay=2, max_delay=20):
+        self.cf_client = cf_client
+        self.stack_name = stack_name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.stack_id = None
+        self.last_event_id = None
+        self.api_calls = 0
+
+    def mark(self):
+        """Remembers the latest event of an existing stack, so only the events of the next operation are shown"""
+        import botocore.exceptions
+        try:
+            self.api_calls += 1
+            events = self.cf_client.describe_stack_events(StackName=self.stack_name)['StackEvents']
+        except botocore.exceptions.ClientError:
+            return
+        if events:
+            self.stack_id = events[0]['StackId']
+            self.last_event_id = events[0]['EventId']
+
+    def watch(self):
+        """Prints new events as they happen and returns the final status of the stack"""
+        import botocore.exceptions
+        if self.stack_id is None:
+            try:
+                self.api_calls += 1
+                self.stack_id = self.cf_client.describe_stacks(StackName=self.stack_name)['Stacks'][0]['StackId']
+            except botocore.exceptions.ClientError as ex:
+                if 'does not exist' in str(ex):
+                    return 'DELETE_COMPLETE'
+                raise
+
+        # stack id -> state of the stack being followed
+        stacks = {self.stack_id: {'name': self.stack_name, 'last_event_id': self.last_event_id, 'since': None}}
+        failures = []
+        status = None
+        delay = self.min_delay
+        while status is None:
+            active = False
+            for stack_id, stack in list(stacks.items()):
+                try:
+                    events = self._newEvents(stack_id, stack)
+                except botocore.exceptions.ClientError as ex:
+                    if 'Throttling' not in str(ex):
+                        raise
+                    delay = self.max_delay
+                    continue
+
+                for event in events:
+                    active = True
+                    self._printEvent(event, nested=stack_id != self.stack_id)
+                    if event['ResourceStatus'].endswith('_FAILED'):
+                        failures.append(event)
+
+                    if event['ResourceType'] == 'AWS::CloudFormation::Stack' and event.get('PhysicalResourceId', '').startswith('arn:'):
+                        if event['PhysicalResourceId'] == stack_id:
+                            if event['ResourceStatus'] in terminal_statuses:
+                                if stack_id == self.stack_id:
+                                    status = event['ResourceStatus']
+                                else:
+                                    del stacks[stack_id]
+                        elif event['PhysicalResourceId'] not in stacks and event['ResourceStatus'].endswith('_IN_PROGRESS'):
+                            # Nested stack discovered, follow it from the time its parent started working on it
+                            stacks[event['PhysicalResourceId']] = {'name': event['LogicalResourceId'], 'last_event_id': None, 'since': event['Timestamp']}
+
+            if status is None:
+                delay = self.min_delay if active else min(delay * 1.5, self.max_delay)
+                time.sleep(delay)
+
+        if failures and status not in success_statuses.values():
+            click.echo(click.style('Failure reasons:', fg='red'))
+            for event in failures:
+                click.echo(click.style('  {} ({}): {}'.format(event['LogicalResourceId'], event['ResourceStatus'], event.get('ResourceStatusReason', '')), fg='red'))
+        return status
+
+    def _newEvents(self, stack_id, stack):
+        """Returns the events since the last call, oldest first"""
+        events = []
+        kwargs = {'StackName': stack_id}
+        while True:
+            self.api_calls += 1
+            with span('poll events', stack=stack['name']):
+                response = self.cf_client.describe_stack_events(**kwargs)
+            for event in response['StackEvents']:
+                if event['EventId'] == stack['last_event_id'] or (stack['since'] is not None and event['Timestamp'] < stack['since']):
+                    response.pop('NextToken', None)
+                    break
+                events.append(event)
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+        if events:
+            stack['last_event_id'] = events[0]['EventId']
+        return list(reversed(events))
+
+    def _printEvent(self, event, nested=False):
+        status = event['ResourceStatus']
+        color = 'red' if 'FAILED' in status or 'ROLLBACK' in status else 'green' if status.endswith('_COMPLETE') else 'yellow'
+        name = '{}/{}'.format(event['StackName'], event['LogicalResourceId']) if nested else event['LogicalResourceId']
+        message = '{}  {}  {}  {}'.format(event['Timestamp'].strftime('%H:%M:%S'), click.style(status.ljust(28), fg=color), name, click.style(event['ResourceType'], fg='cyan'))
+        if event.get('ResourceStatusReason') and 'FAILED' in status:
+            message += '  ' + click.style(event['ResourceStatusReason'], fg='red')
+        click.echo(message)
@@ -0,0 +1,129 @@
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+
+class PrefixedOutput(object):
+    """Stream that prefixes every line written from a worker thread with the label of its target"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        label = getattr(self.local, 'label', None)
+        if label is None:
+            with self.lock:
+                return self.stream.write(text)
+
+        # Keep partial lines per thread so lines of different targets never get mixed
+        buffered = getattr(self.local, 'buffer', '') + text
+        lines = buffered.split('\n')
+        self.local.buffer = lines.pop()
+        prefix = '[{}]'.format(label)
+        if self.stream.isatty():
+            prefix = click.style(prefix, fg='magenta')
+        with self.lock:
+            for line in lines:
+                self.stream.write('{} {}\n'.format(prefix, line))
+        return len(text)
+
+    def flush(self):
+        label = getattr(self.local, 'label', None)
+        if label is not None and getattr(self.local, 'buffer', ''):
+            self.write('\n')
+        with self.lock:
+            self.stream.flush()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def runTargets(targets, action, parallel=4):
+    """Runs the action for every target in a bounded thread pool and returns one result per target"""
+    stdout, stderr = PrefixedOutput(sys.stdout), PrefixedOutput(sys.stderr)
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            return list(executor.map(lambda target: _runLabeled(stdout, stderr, targetLabel(target), action, target), targets))
+    finally:
+        sys.stdout, sys.stderr = stdout.stream, stderr.stream
+
+def runGraph(targets, dependencies, action, parallel=4):
+    """Runs the action for every target as soon as the targets it depends on succeeded
+
+    targets is an ordered dict of name -> target and dependencies a dict of name -> names. The
+    targets that depend, directly or not, on a failed one are skipped, the rest keep running.
+    Returns one result per target in the order of targets.
+    """
+    stdout, stderr = PrefixedOutput(sys.stdout), PrefixedOutput(sys.stderr)
+    results = {}
+    pending = list(targets)
+    running = {}
+
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            while True:
+                progress = True
+                while progress:
+                    progress = False
+                    for name in list(pending):
+                        failed = [dependency for dependency in dependencies.get(name, []) if dependency in results and results[dependency]['error']]
+                        if failed:
+                            results[name] = {'target': name, 'error': 'skipped, {} failed'.format(', '.join(failed)), 'seconds': 0.0, 'skipped': True}
+                        elif all(dependency in results for dependency in dependencies.get(name, [])):
+                            running[executor.submit(_runLabeled, stdout, stderr, name, action, targets[name])] = name
+                        else:
+                            continue
+                        pending.remove(name)
+                        progress = True
+
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+    finally:
+        sys.stdout, sys.stderr = stdout.stream, stderr.stream
+    return [results[name] for name in targets]
+
+def targetLabel(target):
+    return '{}/{}'.format(target['stack_name'], target['region'])
+
+def printSummary(results):
+    """Prints a table with the result of every target"""
+    width = max([len('Target')] + [len(result['target']) for result in results])
+    click.echo('')
+    click.echo(click.style('{}  {}  {}'.format('Target'.ljust(width), 'Result'.ljust(7), 'Time'), bold=True))
+    for result in results:
+        if result.get('skipped'):
+            status = click.style('skipped', fg='yellow')
+        else:
+            status = click.style('failed ', fg='red') if result['error'] else click.style('ok     ', fg='green')
+        click.echo('{}  {}  {:.1f}s{}'.format(result['target'].ljust(width), status, result['seconds'], '  ' + result['error'] if result['error'] else ''))
+
+# ############################### Helper Methods ###############################
+
+def _runLabeled(stdout, stderr, label, action, target):
+    """Runs the action in the current worker thread prefixing its output with the label"""
+    stdout.local.label = stderr.local.label = label
+    started = time.time()
+    error = None
+    try:
+        action(target)
+    except SystemExit as ex:
+        if ex.code not in (None, 0):
+            error = 'exit code {}'.format(ex.code)
+    except Exception as ex:
+        error = str(ex) or type(ex).__name__
+        click.echo(click.style(error, fg='red'), err=True)
+    finally:
+        stdout.flush()
+        stderr.flush()
+    return {'target': label, 'error': error, 'seconds': time.time() - started}
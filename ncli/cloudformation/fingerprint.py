@@ -0,0 +1,53 @@
+import hashlib
+import json
+import os
+
+from .index import TemplateIndex
+
+# Statuses in which the stack matches the last template and parameters that were sent
+stable_statuses = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE']
+
+def stackFingerprint(location, filename, parameters, extra_args=(), packaged_dir=None):
+    """Returns a hash of the master template, every nested template it reaches and the parameters,
+    or None when some nested template can't be found locally. The templates with local code also
+    count with their packaged version in packaged_dir, it changes with every new artifact"""
+    index = TemplateIndex(location)
+    graph, unresolved = index.graph(filename)
+    index.save()
+    if unresolved:
+        return None
+    digest = hashlib.sha256()
+    for relpath in sorted(graph):
+        digest.update(relpath.encode('utf-8') + b'\0' + index.entry(relpath)['sha256'].encode('ascii') + b'\0')
+        packaged = os.path.join(packaged_dir, relpath) if packaged_dir else None
+        if packaged and os.path.isfile(packaged):
+            with open(packaged, 'rb') as file:
+                digest.update(b'packaged\0' + hashlib.sha256(file.read()).hexdigest().encode('ascii') + b'\0')
+    digest.update(json.dumps(parameters, sort_keys=True).encode('utf-8'))
+    digest.update(json.dumps(list(extra_args)).encode('utf-8'))
+    return digest.hexdigest()
+
+def fingerprintKey(key_prefix, region):
+    return '{}/.ncli/fingerprint-{}.json'.format(key_prefix, region)
+
+def isUnchanged(s3_client, cf_client, bucket, key, stack_name, fingerprint):
+    """Whether the stored fingerprint matches and the stack is in a stable status"""
+    import botocore.exceptions
+    try:
+        stored = json.loads(s3_client.get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8'))
+    except botocore.exceptions.ClientError:
+        return False
+    except ValueError:
+        return False
+    if stored.get('fingerprint') != fingerprint or stored.get('stack') != stack_name:
+        return False
+
+    try:
+        stack = cf_client.describe_stacks(StackName=stack_name)['Stacks'][0]
+    except botocore.exceptions.ClientError:
+        return False
+    return stack['StackStatus'] in stable_statuses
+
+def storeFingerprint(s3_client, bucket, key, stack_name, fingerprint):
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps({'stack': stack_name, 'fingerprint': fingerprint}).encode('utf-8'),
+                         ContentType='application/json', ACL='bucket-owner-full-control')
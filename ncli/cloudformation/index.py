@@ -0,0 +1,144 @@
+import hashlib
+import os
+
+import yaml
+
+from .cache import loadJson, projectStateDir, saveJson
+from .loader import SafeUnknownLoader
+
+index_file = 'template-index.json'
+# Parsed templates by path, reused while the file doesn't change (mostly useful in the daemon)
+parsed_templates = {}
+max_parsed_templates = 256
+
+def loadTemplate(path):
+    """Parses a template keeping the intrinsic function tags"""
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    cached = parsed_templates.get(key)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+
+    with open(path, 'r') as file:
+        template = yaml.load(file.read(), Loader=SafeUnknownLoader)
+    if len(parsed_templates) >= max_parsed_templates:
+        parsed_templates.pop(next(iter(parsed_templates)))
+    parsed_templates[key] = ((stat.st_mtime_ns, stat.st_size), template)
+    return template
+
+def templateReferences(location, relpath, template=None):
+    """Returns the local templates referenced by the nested stacks of a template, and the TemplateURLs that couldn't be resolved"""
+    if template is None:
+        template = loadTemplate(os.path.join(location, relpath))
+
+    references = []
+    unresolved = []
+    resources = template.get('Resources') if isinstance(template, dict) else None
+    for name, resource in (resources or {}).items():
+        if not isinstance(resource, dict) or resource.get('Type') != 'AWS::CloudFormation::Stack':
+            continue
+        url = _urlString((resource.get('Properties') or {}).get('TemplateURL'))
+        local = _localTemplate(location, url) if url else None
+        if local is None:
+            unresolved.append('{}: {}'.format(name, url))
+        elif local not in references:
+            references.append(local)
+    return references, unresolved
+
+class TemplateIndex(object):
+    """Graph of the nested stack references between the templates of a project
+
+    The references of every template are cached in the project state directory, keyed by the
+    modification time, size and hash of the file, so only the templates that changed are parsed
+    again. Entries with unresolved or missing references are always parsed again since adding a
+    file can resolve them.
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.path = projectStateDir(location, index_file)
+        self.dirty = False
+        self.entries = loadJson(self.path, {})
+
+    def entry(self, relpath):
+        """Returns the cached entry of the template, refreshing it if the file changed"""
+        full_path = os.path.join(self.location, relpath)
+        stat = os.stat(full_path)
+        entry = self.entries.get(relpath)
+        if entry is not None and not entry['unresolved'] and all(os.path.isfile(os.path.join(self.location, reference)) for reference in entry['references']):
+            if entry['mtime'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                return entry
+        else:
+            entry = None
+
+        with open(full_path, 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        if entry is None or entry['sha256'] != digest:
+            references, unresolved = templateReferences(self.location, relpath)
+            entry = {'sha256': digest, 'references': references, 'unresolved': unresolved}
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        self.entries[relpath] = entry
+        self.dirty = True
+        return entry
+
+    def graph(self, filename):
+        """Returns the references of every template reachable from the master template, and the unresolved TemplateURLs"""
+        graph = {}
+        unresolved = []
+        pending = [filename]
+        while pending:
+            relpath = pending.pop(0)
+            if relpath in graph:
+                continue
+            entry = self.entry(relpath)
+            graph[relpath] = entry['references']
+            unresolved.extend('{} -> {}'.format(relpath, item) for item in entry['unresolved'])
+            pending.extend(entry['references'])
+        return graph, unresolved
+
+    def save(self):
+        if not self.dirty:
+            return
+        saveJson(self.path, self.entries, indent=2, sort_keys=True)
+        self.dirty = False
+
+def reachableTemplates(location, filename):
+    """Returns the master template and every local template it reaches through nested stacks"""
+    index = TemplateIndex(location)
+    graph, unresolved = index.graph(filename)
+    index.save()
+    return list(graph), unresolved
+
+# ############################### Helper Methods ###############################
+
+def _urlString(value):
+    """Flattens a TemplateURL value to a string, references become ${Name} placeholders"""
+    tag = getattr(value, 'wrapTag', None)
+    if tag is None and isinstance(value, dict) and len(value) == 1:
+        function, value = list(value.items())[0]
+        tag = {'Fn::Sub': '!Sub', 'Fn::Join': '!Join', 'Ref': '!Ref'}.get(function)
+        if tag is None:
+            return None
+
+    if tag == '!Ref':
+        return '${' + str(value) + '}'
+    if tag == '!Join':
+        if not isinstance(value, list) or len(value) != 2:
+            return None
+        return value[0].join(_urlString(part) or '${?}' for part in value[1])
+    if tag == '!Sub' and isinstance(value, list):
+        value = value[0]
+    if isinstance(value, str):
+        return str(value)
+    return None
+
+def _localTemplate(location, url):
+    """Finds the local file for a TemplateURL by matching the longest suffix of its path"""
+    components = url.split('?')[0].split('/')
+    for i in range(len(components)):
+        candidate = '/'.join(components[i:])
+        if not candidate or candidate.startswith('/') or '..' in components[i:] or '${' in candidate:
+            continue
+        if os.path.isfile(os.path.join(location, candidate)):
+            return candidate
+    return None
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+import yaml
+
+from ..trace import span
+from .cache import loadJson, projectStateDir, saveJson, state_dir
+from .loader import SafeUnknownDumper, SafeUnknownLoader
+
+# Properties that point to local code, by resource type
+code_properties = {
+    'AWS::Lambda::Function': 'Code',
+    'AWS::Lambda::LayerVersion': 'Content',
+    'AWS::Serverless::Function': 'CodeUri',
+    'AWS::Serverless::LayerVersion': 'ContentUri',
+}
+artifacts_dir = 'artifacts'
+packaged_dir = 'packaged'
+index_file = 'index.json'
+# Fixed timestamp for every zip entry (the earliest one zip supports) so the same files always give the same zip
+zip_timestamp = (1980, 1, 1, 0, 0, 0)
+multipart_size = 8 * 1024 * 1024
+# Several targets of the same project may be packaging at the same time
+artifacts_lock = threading.Lock()
+
+def packageTemplates(client, location, relpaths, bucket, key_prefix, output_dir, acl='bucket-owner-full-control', jobs=10):
+    """Uploads the local code referenced by the templates and writes the templates that reference
+    it, pointing to the uploaded artifacts, in output_dir. Returns the path of the packaged
+    templates by the path of the original ones, relative to the location.
+
+    Artifacts are reproducible zips named by the hash of their content, so code that didn't
+    change is never uploaded again.
+    """
+    templates = {}
+    references = []
+    for relpath in relpaths:
+        path = os.path.join(location, relpath)
+        with open(path, 'r') as file:
+            template = yaml.load(file.read(), Loader=SafeUnknownLoader)
+        found = codeReferences(template, os.path.dirname(path))
+        if found:
+            templates[relpath] = template
+            references.extend(found)
+        elif os.path.isfile(os.path.join(output_dir, relpath)):
+            # It doesn't reference local code anymore, the stack fingerprint shouldn't see the old packaged version
+            os.remove(os.path.join(output_dir, relpath))
+    if not references:
+        return {}
+
+    sources = sorted(set(source for _, _, _, source in references))
+    with artifacts_lock:
+        artifacts = buildArtifacts(location, sources, jobs)
+
+    keys = dict((source, '{}/{}/{}{}'.format(key_prefix, artifacts_dir, digest, os.path.splitext(path)[1])) for source, (path, digest) in artifacts.items())
+    uploads = sorted(set((artifacts[source][0], keys[source]) for source in sources))
+    uploaded = uploadArtifacts(client, bucket, uploads, acl, jobs)
+    click.echo(click.style('{} artifacts uploaded, {} unchanged'.format(uploaded, len(uploads) - uploaded), fg='green'))
+
+    packaged = {}
+    for properties, name, resource_type, source in references:
+        if resource_type.startswith('AWS::Serverless::'):
+            properties[name] = 's3://{}/{}'.format(bucket, keys[source])
+        else:
+            properties[name] = {'S3Bucket': bucket, 'S3Key': keys[source]}
+    for relpath, template in templates.items():
+        path = os.path.join(output_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            yaml.dump(template, file, Dumper=SafeUnknownDumper, sort_keys=False)
+        packaged[relpath] = path
+    return packaged
+
+def codeReferences(template, base_dir):
+    """Returns (properties, property name, resource type, local path) of every resource whose code is a local path"""
+    references = []
+    resources = template.get('Resources') if isinstance(template, dict) else None
+    for resource in (resources or {}).values():
+        if not isinstance(resource, dict) or resource.get('Type') not in code_properties:
+            continue
+        properties = resource.get('Properties')
+        name = code_properties[resource['Type']]
+        value = properties.get(name) if isinstance(properties, dict) else None
+        # Tagged values (!Sub...) and S3 locations aren't local paths
+        if not isinstance(value, str) or getattr(value, 'wrapTag', None) or value.startswith(('s3://', 'http://', 'https://')):
+            continue
+        source = os.path.abspath(os.path.join(base_dir, value))
+        if not os.path.exists(source):
+            click.echo(click.style('The code path {} doesn\'t exist, leaving it as it is'.format(value), fg='yellow'))
+            continue
+        references.append((properties, name, resource['Type'], source))
+    return references
+
+def buildArtifacts(location, sources, jobs=10):
+    """Returns (artifact path, sha256) by source path, building the zips of the sources that changed
+
+    Zip and jar files are used as they are. Built zips are kept in the project state directory
+    and reused while the size, modification time and mode of every file of the source match.
+    """
+    directory = projectStateDir(location, artifacts_dir)
+    index_path = os.path.join(directory, index_file)
+    index = loadJson(index_path, {})
+    os.makedirs(directory, exist_ok=True)
+
+    # Workers don't print, their threads aren't labeled with the target when several targets run at once
+    def build(source):
+        """Returns the path and sha256 of the artifact, and whether it was built"""
+        if os.path.isfile(source) and source.endswith(('.zip', '.jar')):
+            return source, _fileDigest(source), False
+        files = _sourceFiles(source)
+        signature = _treeSignature(files)
+        cached = index.get(source)
+        if cached and cached['signature'] == signature and os.path.isfile(os.path.join(directory, cached['sha256'] + '.zip')):
+            return os.path.join(directory, cached['sha256'] + '.zip'), cached['sha256'], False
+
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        with span('zip', source=source):
+            writeZip(files, temp_path)
+        digest = _fileDigest(temp_path)
+        path = os.path.join(directory, digest + '.zip')
+        os.replace(temp_path, path)
+        index[source] = {'signature': signature, 'sha256': digest}
+        return path, digest, True
+
+    artifacts = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = dict((executor.submit(build, source), source) for source in sources)
+        for future in as_completed(futures):
+            path, digest, built = future.result()
+            artifacts[futures[future]] = (path, digest)
+            if built:
+                click.echo('package: {}'.format(futures[future]))
+
+    # Forget the zips of sources that don't exist anymore or changed
+    index = dict((source, entry) for source, entry in index.items() if os.path.exists(source))
+    kept = set(entry['sha256'] + '.zip' for entry in index.values())
+    for name in os.listdir(directory):
+        if name.endswith('.zip') and name not in kept:
+            os.remove(os.path.join(directory, name))
+    saveJson(index_path, index, indent=2, sort_keys=True)
+    return artifacts
+
+def writeZip(files, path):
+    """Writes the (name, path) files to a zip that only depends on their names, content and
+    executable bit. The content is streamed, files are never loaded in memory as a whole"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, source in files:
+            info = zipfile.ZipInfo(name, date_time=zip_timestamp)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.create_system = 3
+            mode = 0o755 if os.stat(source).st_mode & stat.S_IXUSR else 0o644
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            with open(source, 'rb') as src, archive.open(info, 'w') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def uploadArtifacts(client, bucket, artifacts, acl='bucket-owner-full-control', jobs=10):
+    """Uploads the (path, key) artifacts that aren't in the bucket yet, large ones in concurrent parts.
+    Returns the number of uploaded artifacts"""
+    import botocore.exceptions
+    from boto3.s3.transfer import TransferConfig
+    config = TransferConfig(multipart_threshold=multipart_size, multipart_chunksize=multipart_size, max_concurrency=jobs)
+
+    def upload(artifact):
+        path, key = artifact
+        try:
+            client.head_object(Bucket=bucket, Key=key)
+            return False
+        except botocore.exceptions.ClientError as ex:
+            if ex.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise
+        with span('upload artifact', key=key):
+            client.upload_file(path, bucket, key, ExtraArgs={'ACL': acl, 'ContentType': 'application/zip'}, Config=config)
+        return True
+
+    uploaded = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = dict((executor.submit(upload, artifact), artifact) for artifact in artifacts)
+        for future in as_completed(futures):
+            if future.result():
+                uploaded += 1
+                click.echo('upload: {} to s3://{}/{}'.format(futures[future][0], bucket, futures[future][1]))
+    return uploaded
+
+def packagedDir(location, env, region):
+    """Returns the directory of the packaged templates of an environment and region, they point to its bucket"""
+    return projectStateDir(location, packaged_dir, '{}-{}'.format(env, region))
+
+# ############################### Helper Methods ###############################
+
+def _sourceFiles(source):
+    """Returns the sorted (name in the zip, path) of the files of a directory, or of a single file"""
+    if os.path.isfile(source):
+        return [(os.path.basename(source), source)]
+    files = []
+    for root, dirs, names in os.walk(source, followlinks=True):
+        dirs[:] = [d for d in dirs if d != state_dir]
+        for name in names:
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, source).replace(os.sep, '/'), path))
+    return sorted(files)
+
+def _treeSignature(files):
+    digest = hashlib.sha256()
+    for name, path in files:
+        stats = os.stat(path)
+        digest.update('{}\0{}\0{}\0{}\0'.format(name, stats.st_size, stats.st_mtime_ns, stats.st_mode & stat.S_IXUSR).encode('utf-8'))
+    return digest.hexdigest()
+
+def _fileDigest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
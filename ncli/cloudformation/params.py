@@ -0,0 +1,101 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ..trace import span
+
+# {{ssm:/app/dev/vpc-id}}, {{ssm-secure:/app/dev/db-password}} or {{secretsmanager:prod/db}}
+reference_pattern = re.compile(r'\{\{(ssm|ssm-secure|secretsmanager):([^{}]+)\}\}')
+# GetParameters accepts 10 names per call
+ssm_batch_size = 10
+
+# Resolved values by (region, profile, kind, name), shared by every target of the run
+resolved = {}
+# One lock per (region, profile) so targets in the same region resolve each reference only once
+scope_locks = {}
+scope_locks_lock = threading.Lock()
+
+class UnresolvedReferences(ValueError):
+    def __init__(self, references):
+        self.references = references
+        ValueError.__init__(self, 'Unable to resolve ' + ', '.join('{{' + kind + ':' + name + '}}' for kind, name in references))
+
+def parameterReferences(parameters):
+    """Returns the (kind, name) of every reference in the parameter values"""
+    references = []
+    for parameter in parameters:
+        for reference in reference_pattern.findall(str(parameter.get('ParameterValue', ''))):
+            if reference not in references:
+                references.append(reference)
+    return references
+
+def resolveParameters(parameters, client_factory, region, profile, jobs=10):
+    """Returns the parameters with their references replaced by the values stored in SSM
+    and Secrets Manager, client_factory(service) returns the client of the region and profile
+
+    Every missing reference is reported at once with UnresolvedReferences, before anything
+    is deployed. SSM parameters are fetched 10 at a time, secrets one per call, all of them
+    concurrently.
+    """
+    references = parameterReferences(parameters)
+    if not references:
+        return parameters
+
+    with _scopeLock(region, profile):
+        pending = [(kind, name) for kind, name in references if (region, profile, kind, name) not in resolved]
+        values, missing = _fetch(pending, client_factory, jobs)
+        for (kind, name), value in values.items():
+            resolved[(region, profile, kind, name)] = value
+    if missing:
+        raise UnresolvedReferences(missing)
+
+    def substitute(match):
+        return resolved[(region, profile, match.group(1), match.group(2))]
+
+    return [dict(parameter, ParameterValue=reference_pattern.sub(substitute, str(parameter['ParameterValue']))) if 'ParameterValue' in parameter else parameter for parameter in parameters]
+
+# ############################### Helper Methods ###############################
+
+def _scopeLock(region, profile):
+    with scope_locks_lock:
+        return scope_locks.setdefault((region, profile), threading.Lock())
+
+def _fetch(references, client_factory, jobs):
+    """Returns the values found by (kind, name) and the references that don't exist"""
+    if not references:
+        return {}, []
+    requests = []
+    for kind in ('ssm', 'ssm-secure'):
+        names = [name for reference_kind, name in references if reference_kind == kind]
+        requests.extend((kind, names[i:i + ssm_batch_size]) for i in range(0, len(names), ssm_batch_size))
+    requests.extend(('secretsmanager', [name]) for reference_kind, name in references if reference_kind == 'secretsmanager')
+
+    # Create the clients before going concurrent, botocore doesn't like creating them from several threads
+    clients = dict((service, client_factory(service)) for service in set('secretsmanager' if kind == 'secretsmanager' else 'ssm' for kind, _ in requests))
+
+    def fetch(request):
+        kind, names = request
+        with span('resolve references', kind=kind, count=len(names)):
+            if kind == 'secretsmanager':
+                return _getSecret(clients['secretsmanager'], names[0])
+            return _getParameters(clients['ssm'], kind, names)
+
+    values = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for (kind, names), found in zip(requests, executor.map(fetch, requests)):
+            values.update(((kind, name), value) for name, value in found.items())
+    return values, [reference for reference in references if reference not in values]
+
+def _getParameters(ssm_client, kind, names):
+    response = ssm_client.get_parameters(Names=names, WithDecryption=kind == 'ssm-secure')
+    return dict((parameter['Name'], parameter['Value']) for parameter in response['Parameters'])
+
+def _getSecret(secrets_client, secret_id):
+    import botocore.exceptions
+    try:
+        response = secrets_client.get_secret_value(SecretId=secret_id)
+    except botocore.exceptions.ClientError as ex:
+        if ex.response.get('Error', {}).get('Code') == 'ResourceNotFoundException':
+            return {}
+        raise
+    return {secret_id: response['SecretString']} if 'SecretString' in response else {}
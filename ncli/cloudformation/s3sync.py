@@ -0,0 +1,96 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+
+from ..trace import span
+from .cache import loadJson, projectStateDir, saveJson, state_dir
+
+manifest_file = 'sync-manifest.json'
+manifest_lock = threading.Lock()
+
+def syncTemplates(client, location, bucket, key_prefix, acl='bucket-owner-full-control', jobs=10, full=False, files=None, bodies=None):
+    """Uploads the templates that changed since the last sync and returns the number of failures,
+    files limits the sync to those paths (relative to the location) instead of every template and
+    bodies replaces the content of some of them with other files (eg. the packaged templates)"""
+    manifest_path = projectStateDir(location, manifest_file)
+    destination = 's3://{}/{}'.format(bucket, key_prefix)
+    synced = loadJson(manifest_path, {}).get(destination, {})
+
+    templates = findTemplates(location) if files is None else [os.path.join(location, relpath) for relpath in files]
+    pending = []
+    for path in templates:
+        relpath = os.path.relpath(path, location).replace(os.sep, '/')
+        path = (bodies or {}).get(relpath, path)
+        digest = _fileDigest(path)
+        if full or synced.get(relpath) != digest:
+            pending.append((relpath, path, digest))
+
+    failures = 0
+    if pending:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(_uploadFile, client, path, bucket, key_prefix + '/' + relpath, digest, acl): (relpath, path, digest)
+                for relpath, path, digest in pending
+            }
+            for future in as_completed(futures):
+                relpath, path, digest = futures[future]
+                try:
+                    future.result()
+                    synced[relpath] = digest
+                    click.echo('upload: {} to {}/{}'.format(path, destination, relpath))
+                except Exception as ex:
+                    failures += 1
+                    click.echo(click.style('upload failed: {} to {}/{} ({})'.format(path, destination, relpath, ex), fg='red'))
+
+        # Several targets of the same project may be syncing at the same time
+        with manifest_lock:
+            manifest = loadJson(manifest_path, {})
+            manifest[destination] = synced
+            saveJson(manifest_path, manifest, indent=2, sort_keys=True)
+
+    click.echo(click.style('{} uploaded, {} unchanged'.format(len(pending) - failures, len(templates) - len(pending)), fg='green' if failures == 0 else 'yellow'))
+    return failures
+
+def unsyncedTemplates(location, relpaths, bucket, key_prefix, packaged_dir=None):
+    """Returns the templates whose local content (or packaged one, from packaged_dir) isn't what
+    the last sync uploaded to the bucket and prefix, according to the sync manifest"""
+    synced = loadJson(projectStateDir(location, manifest_file), {}).get('s3://{}/{}'.format(bucket, key_prefix), {})
+    unsynced = []
+    for relpath in relpaths:
+        paths = [os.path.join(location, relpath)] + ([os.path.join(packaged_dir, relpath)] if packaged_dir else [])
+        if synced.get(relpath) not in [_fileDigest(path) for path in paths if os.path.isfile(path)]:
+            unsynced.append(relpath)
+    return unsynced
+
+def findTemplates(location):
+    """Returns the path of every *.yml file under the location, the same set `aws s3 sync --include '*.yml'` picks"""
+    templates = []
+    for root, dirs, files in os.walk(location, followlinks=True):
+        dirs[:] = sorted(d for d in dirs if d != state_dir)
+        for name in sorted(files):
+            if name.endswith('.yml'):
+                templates.append(os.path.join(root, name))
+    return templates
+
+# ############################### Helper Methods ###############################
+
+def _fileDigest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def _uploadFile(client, path, bucket, key, digest, acl):
+    content_md5 = base64.b64encode(bytes.fromhex(digest)).decode('ascii')
+    extra = {}
+    content_type = mimetypes.guess_type(path)[0]
+    if content_type:
+        extra['ContentType'] = content_type
+    with span('upload', key=key), open(path, 'rb') as body:
+        client.put_object(Bucket=bucket, Key=key, Body=body, ACL=acl, ContentMD5=content_md5, **extra)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import time
+
+import click
+
+from .cache import loadJson, saveJson, userCacheDir
+
+def statusRows(targets, stacks):
+    """Returns one row per target from the described stacks by (region, profile, stack name)"""
+    rows = []
+    for target in targets:
+        stack = stacks.get((target['region'], target['profile'], target['stack_name']))
+        updated = (stack.get('LastUpdatedTime') or stack.get('CreationTime')) if stack else None
+        rows.append({
+            'environment': target['env'],
+            'region': target['region'],
+            'stack': target['stack_name'],
+            'status': stack['StackStatus'] if stack else 'NOT_FOUND',
+            'updated': updated.isoformat() if updated else None,
+            'drift': stack.get('DriftInformation', {}).get('StackDriftStatus', 'NOT_CHECKED') if stack else None,
+        })
+    return rows
+
+def cachedRows(targets, ttl):
+    """Returns the rows stored for the same targets less than ttl seconds ago, or None"""
+    cached = loadJson(_cachePath(targets), None)
+    if cached is None or time.time() - cached.get('time', 0) > ttl:
+        return None
+    return cached['rows']
+
+def storeRows(targets, rows):
+    saveJson(_cachePath(targets), {'time': time.time(), 'rows': rows})
+
+def printStatus(rows):
+    """Prints the rows as a table"""
+    columns = [('environment', 'Environment'), ('region', 'Region'), ('stack', 'Stack'), ('status', 'Status'), ('updated', 'Last updated'), ('drift', 'Drift')]
+    values = [dict((key, _formatValue(key, row[key])) for key, _ in columns) for row in rows]
+    widths = dict((key, max([len(title)] + [len(value[key]) for value in values])) for key, title in columns)
+    click.echo(click.style('  '.join(title.ljust(widths[key]) for key, title in columns), bold=True))
+    for row, value in zip(rows, values):
+        cells = []
+        for key, _ in columns:
+            cell = value[key] if key == columns[-1][0] else value[key].ljust(widths[key])
+            if key == 'status':
+                cell = click.style(cell, fg=_statusColor(row['status']))
+            elif key == 'drift' and row['drift'] == 'DRIFTED':
+                cell = click.style(cell, fg='red')
+            cells.append(cell)
+        click.echo('  '.join(cells))
+
+# ############################### Helper Methods ###############################
+
+def _cachePath(targets):
+    # Same targets with different credentials may be different stacks
+    key = json.dumps([[target['region'], target['profile'], target['stack_name']] for target in targets] + [os.environ.get('AWS_PROFILE')])
+    return userCacheDir('status', hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '.json')
+
+def _formatValue(key, value):
+    if value is None:
+        return '-'
+    if key == 'updated':
+        return value[:19].replace('T', ' ')
+    return value
+
+def _statusColor(status):
+    if status == 'NOT_FOUND':
+        return 'white'
+    return 'red' if 'FAILED' in status or 'ROLLBACK' in status else 'green' if status.endswith('_COMPLETE') else 'yellow'
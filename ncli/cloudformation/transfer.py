@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import click
+
+from ..trace import span
+
+def bulkDownload(items, fetch, overwrite=False, jobs=10):
+    """Downloads the (key, local path) items concurrently, fetch(key) returns the content of a key
+
+    Existing files are skipped unless overwrite is set. Every file is written to a temporary
+    file and renamed, so an interrupted download never leaves a partial file behind. The first
+    error is raised once the rest of the downloads finished.
+    """
+    started = time.time()
+    pending = []
+    counts = {'created': 0, 'overwritten': 0, 'skipped': 0}
+    for key, path in items:
+        if os.path.isfile(path) and not overwrite:
+            counts['skipped'] += 1
+            click.echo(path + " skipped")
+        else:
+            pending.append((key, path, 'overwritten' if os.path.isfile(path) else 'created'))
+
+    for directory in set(os.path.dirname(path) for key, path, status in pending):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    transferred = 0
+    errors = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_tracedFetch, fetch, key): (key, path, status) for key, path, status in pending}
+        for future in as_completed(futures):
+            key, path, status = futures[future]
+            try:
+                content = future.result()
+            except Exception as ex:
+                errors.append(ex)
+                continue
+            writeFile(path, content)
+            transferred += len(content)
+            counts[status] += 1
+            click.echo(path + " " + status)
+
+    elapsed = max(time.time() - started, 0.001)
+    click.echo(click.style('{created} created, {overwritten} overwritten, {skipped} skipped'.format(**counts), fg='green' if not errors else 'yellow') +
+               ' ({} in {:.2f}s, {}/s)'.format(_formatSize(transferred), elapsed, _formatSize(transferred / elapsed)))
+    if errors:
+        raise errors[0]
+    return counts
+
+def writeFile(path, content):
+    """Writes the content to a temporary file and moves it in place, so readers never see partial files"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+def _tracedFetch(fetch, key):
+    with span('download', key=key):
+        return fetch(key)
+
+def _formatSize(size):
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024.0
+    return '{:.1f}GB'.format(size)
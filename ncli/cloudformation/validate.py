@@ -0,0 +1,167 @@
+import hashlib
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .cache import loadJson, projectStateDir, saveJson
+from .index import loadTemplate
+
+cache_file = 'validate-cache.json'
+# Bump when the rules change so cached results are checked again
+rules_version = 2
+
+template_sections = ['AWSTemplateFormatVersion', 'Description', 'Metadata', 'Parameters', 'Rules', 'Mappings', 'Conditions', 'Transform', 'Resources', 'Outputs']
+# Sections only valid with a transform (eg. the Globals of SAM)
+transform_sections = ['Globals']
+pseudo_parameters = ['AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue', 'AWS::Partition', 'AWS::Region', 'AWS::StackId', 'AWS::StackName', 'AWS::URLSuffix']
+max_template_body = 51200
+sub_variable = re.compile(r'\$\{([^!}][^}]*)\}')
+
+def checkTemplate(path):
+    """Checks the structure of a template, returns its issues and its parameters (name -> has default)"""
+    try:
+        template = loadTemplate(path)
+    except Exception as ex:
+        return {'issues': [['error', 'Invalid YAML: {}'.format(ex).replace('\n', ' ')]], 'parameters': {}}
+    if not isinstance(template, dict):
+        return {'issues': [['error', 'The template is not a mapping']], 'parameters': {}}
+
+    issues = []
+    for section in template:
+        if section not in template_sections and not (section in transform_sections and template.get('Transform')):
+            issues.append(['error', 'Unknown top level section {}'.format(section)])
+    if not isinstance(template.get('Resources'), dict) or not template['Resources']:
+        issues.append(['error', 'The template doesn\'t have any Resources'])
+
+    parameters = template.get('Parameters') if isinstance(template.get('Parameters'), dict) else {}
+    resources = template.get('Resources') if isinstance(template.get('Resources'), dict) else {}
+    refs, attributes = _collectReferences({key: value for key, value in template.items() if key != 'Parameters'})
+
+    # Transforms (eg. SAM) create resources that aren't in the template
+    level = 'warning' if template.get('Transform') else 'error'
+    for name in sorted(set(refs)):
+        if name not in parameters and name not in resources and name not in pseudo_parameters:
+            issues.append([level, 'Undefined reference to {}'.format(name)])
+    for name in sorted(set(attributes)):
+        if name not in resources:
+            issues.append([level, 'GetAtt of undefined resource {}'.format(name)])
+    for name in parameters:
+        if name not in refs:
+            issues.append(['warning', 'Unused parameter {}'.format(name)])
+
+    return {
+        'issues': issues,
+        'parameters': {name: isinstance(value, dict) and 'Default' in value for name, value in parameters.items()},
+    }
+
+def checkParameters(template_parameters, parameters):
+    """Compares the keys of a parameters file with the parameters of its template"""
+    issues = []
+    keys = [parameter.get('ParameterKey') for parameter in parameters]
+    for key in keys:
+        if key not in template_parameters:
+            issues.append(['error', 'Parameter {} is not defined in the template'.format(key)])
+    for name, has_default in sorted(template_parameters.items()):
+        if not has_default and name not in keys:
+            issues.append(['error', 'Parameter {} has no default and is missing in the parameters file'.format(name)])
+    return issues
+
+def checkTemplates(location, relpaths, jobs=None, cf_client=None):
+    """Checks the templates, returns (results by path, number of cached results)
+
+    Results are cached by the hash of each file, so only the templates that changed are
+    parsed again. The local checks run in a process pool, the optional remote ValidateTemplate
+    calls in a thread pool.
+    """
+    cache_path = projectStateDir(location, cache_file)
+    cache = _loadCache(cache_path)
+    results = {}
+    pending = {}
+    for relpath in relpaths:
+        with open(os.path.join(location, relpath), 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        cached = cache.get(relpath)
+        if cached and cached['sha256'] == digest and (cf_client is None or 'remote' in cached):
+            results[relpath] = cached
+        else:
+            pending[relpath] = digest
+
+    if pending:
+        paths = [os.path.join(location, relpath) for relpath in pending]
+        if len(paths) > 2:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                checked = list(executor.map(checkTemplate, paths, chunksize=max(1, len(paths) // 32)))
+        else:
+            checked = [checkTemplate(path) for path in paths]
+
+        for (relpath, digest), result in zip(pending.items(), checked):
+            result['sha256'] = digest
+            results[relpath] = result
+
+        if cf_client is not None:
+            with ThreadPoolExecutor(max_workers=jobs or 4) as executor:
+                remote = list(executor.map(lambda relpath: _validateRemote(cf_client, os.path.join(location, relpath)), pending))
+            for relpath, issue in zip(pending, remote):
+                results[relpath]['remote'] = True
+                if issue:
+                    results[relpath]['issues'].append(issue)
+
+        cache.update((relpath, results[relpath]) for relpath in pending)
+        _saveCache(cache_path, cache)
+
+    return results, len(relpaths) - len(pending)
+
+# ############################### Helper Methods ###############################
+
+def _collectReferences(value, refs=None, attributes=None):
+    """Returns the names used in Ref/Sub and the resources used in GetAtt"""
+    refs = [] if refs is None else refs
+    attributes = [] if attributes is None else attributes
+    tag = getattr(value, 'wrapTag', None)
+    if isinstance(value, dict) and len(value) == 1 and list(value)[0] in ('Ref', 'Fn::GetAtt', 'Fn::Sub'):
+        tag, value = {'Ref': '!Ref', 'Fn::GetAtt': '!GetAtt', 'Fn::Sub': '!Sub'}[list(value)[0]], list(value.values())[0]
+
+    if tag == '!Ref' and isinstance(value, str):
+        refs.append(str(value))
+    elif tag == '!GetAtt':
+        name = str(value).split('.')[0] if isinstance(value, str) else value[0] if isinstance(value, list) and value else None
+        if isinstance(name, str):
+            attributes.append(name)
+    elif tag == '!Sub':
+        string, variables = (value[0], value[1] if len(value) > 1 else {}) if isinstance(value, list) else (value, {})
+        for variable in sub_variable.findall(str(string)):
+            name = variable.split('.')[0]
+            if name in (variables or {}):
+                continue
+            if '.' in variable and not variable.startswith('AWS::'):
+                attributes.append(name)
+            else:
+                refs.append(variable)
+        if isinstance(variables, dict):
+            _collectReferences(list(variables.values()), refs, attributes)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collectReferences(item, refs, attributes)
+    elif isinstance(value, list):
+        for item in value:
+            _collectReferences(item, refs, attributes)
+    return refs, attributes
+
+def _validateRemote(cf_client, path):
+    import botocore.exceptions
+    with open(path, 'r') as file:
+        body = file.read()
+    if len(body.encode('utf-8')) > max_template_body:
+        return ['warning', 'Too large for a remote validation without uploading it']
+    try:
+        cf_client.validate_template(TemplateBody=body)
+    except botocore.exceptions.ClientError as ex:
+        return ['error', ex.response.get('Error', {}).get('Message', str(ex))]
+    return None
+
+def _loadCache(path):
+    cache = loadJson(path, {})
+    return cache.get('results', {}) if cache.get('version') == rules_version else {}
+
+def _saveCache(path, results):
+    saveJson(path, {'version': rules_version, 'results': results})
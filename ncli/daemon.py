@@ -0,0 +1,116 @@
+import json
+import os
+import socket
+import struct
+import sys
+
+# Thin client for `ncli serve`. It only uses the standard library so forwarding a command
+# doesn't pay for importing click, boto3 or yaml
+
+# Commands that don't prompt, so they can run in the daemon without a terminal. The daemon
+# still sends back the ones that could ask for an MFA code, see server._mayPromptForMfa
+daemon_commands = [
+    ('cf', 'info'),
+    ('cf', 'sync'),
+    ('cf', 'validate'),
+    ('cf', 'status'),
+    ('cf', 'graph'),
+    ('cf', 'list-templates'),
+    ('cf', 'list-examples'),
+]
+# Global options of the ncli group that take a value
+value_options = ['--region', '--profile', '--trace', '--trace-format']
+# Environment that changes how commands behave, the daemon only runs commands with the same values
+forwarded_env_prefixes = ('AWS_', 'NCLI_')
+ignored_env = ['NCLI_SOCKET', 'NCLI_NO_DAEMON']
+
+def main():
+    """Entry point of the ncli command, forwards the command to the daemon when it's running"""
+    argv = sys.argv[1:]
+    if not os.environ.get('NCLI_NO_DAEMON') and commandPath(argv) in daemon_commands:
+        code = forward(argv)
+        if code is not None:
+            sys.exit(code)
+
+    from .ncli import ncli
+    ncli(prog_name='ncli')
+
+def socketPath():
+    if os.environ.get('NCLI_SOCKET'):
+        return os.environ['NCLI_SOCKET']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'ncli.sock')
+    from .cloudformation.cache import userCacheDir
+    return userCacheDir('ncli.sock')
+
+def commandPath(argv):
+    """Returns the names of the group and command in argv, eg. ('cf', 'sync')"""
+    path = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in value_options:
+            skip = True
+        elif not arg.startswith('-'):
+            path.append(arg)
+            if len(path) == 2:
+                break
+    return tuple(path)
+
+def relevantEnv(environ):
+    return dict((key, value) for key, value in environ.items() if key.startswith(forwarded_env_prefixes) and key not in ignored_env)
+
+def forward(argv):
+    """Runs the command in the daemon streaming its output, returns None if it has to run in process"""
+    path = socketPath()
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    started = False
+    try:
+        connection.connect(path)
+        request = {
+            'argv': argv,
+            'cwd': os.getcwd(),
+            'env': relevantEnv(os.environ),
+            'color': sys.stdout.isatty(),
+        }
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+        reader = connection.makefile('rb')
+        output = {b'o': sys.stdout, b'e': sys.stderr}
+        while True:
+            kind, payload = readFrame(reader)
+            if kind in output:
+                started = True
+                stream = getattr(output[kind], 'buffer', None)
+                if stream is None:
+                    output[kind].write(payload.decode('utf-8', 'replace'))
+                else:
+                    stream.write(payload)
+                output[kind].flush()
+            elif kind == b'x':
+                return struct.unpack('!i', payload)[0]
+            else:
+                return None
+    except (OSError, ValueError, struct.error):
+        if not started:
+            # Daemon not running (stale socket), the command can safely run in process
+            return None
+        sys.stderr.write('The ncli daemon stopped in the middle of the command\n')
+        return 1
+    finally:
+        connection.close()
+
+def writeFrame(connection, kind, payload):
+    connection.sendall(kind + struct.pack('!I', len(payload)) + payload)
+
+def readFrame(reader):
+    header = reader.read(5)
+    if len(header) < 5:
+        raise ValueError('Connection closed')
+    size = struct.unpack('!I', header[1:])[0]
+    return header[:1], reader.read(size)
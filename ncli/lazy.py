@@ -0,0 +1,40 @@
+import importlib
+
+import click
+
+class LazyGroup(click.Group):
+    """Click group that only imports a subcommand's module when the subcommand is invoked"""
+
+    def __init__(self, *args, **kwargs):
+        # name -> ('package.module:attribute', 'short help shown in --help')
+        self.lazy_subcommands = kwargs.pop('lazy_subcommands', {})
+        super(LazyGroup, self).__init__(*args, **kwargs)
+
+    def list_commands(self, ctx):
+        return sorted(set(super(LazyGroup, self).list_commands(ctx)) | set(self.lazy_subcommands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name in self.lazy_subcommands and cmd_name not in self.commands:
+            module_name, attribute = self.lazy_subcommands[cmd_name][0].split(':')
+            self.add_command(getattr(importlib.import_module(module_name), attribute), cmd_name)
+        return super(LazyGroup, self).get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        """Same as click.Group.format_commands but uses the declared help for commands that are not loaded"""
+        names = self.list_commands(ctx)
+        if not names:
+            return
+
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                command = self.commands[name]
+                if command.hidden:
+                    continue
+                rows.append((name, command.get_short_help_str(limit)))
+            else:
+                rows.append((name, self.lazy_subcommands[name][1]))
+
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
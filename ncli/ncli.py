@@ -1,9 +1,7 @@
 import click
-import boto3
 import functools
-import yaml
 
-from .cloudformation.cf import cf
+from .lazy import LazyGroup
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
@@ -25,13 +23,23 @@ def common_params(func):
         return func(*args, **kwargs)
     return wrapper
 
-@click.group(context_settings=CONTEXT_SETTINGS)
+# Subcommands are imported when invoked so `ncli --help` doesn't pay for boto3 and friends
+lazy_subcommands = {
+    'cf': ('ncli.cloudformation.cf:cf', 'nClouds thin wrapper over the AWS CLI for CloudFormation'),
+    'serve': ('ncli.server:serve', 'Run the ncli daemon'),
+}
+
+@click.group(cls=LazyGroup, lazy_subcommands=lazy_subcommands, context_settings=CONTEXT_SETTINGS)
 @click.version_option(__version__)
 @common_params
+@click.option('--trace', 'trace_file', type=click.Path(dir_okay=False, writable=True), help="Write the timing spans and AWS API counters of the command to this file")
+@click.option('--trace-format', 'trace_format', type=click.Choice(['chrome', 'summary']), default='chrome', show_default=True, help="Chrome trace events (chrome://tracing, Perfetto) or a flat summary")
 @click.pass_context
-def ncli(ctx, region, profile):
+def ncli(ctx, region, profile, trace_file, trace_format):
     # session = boto3.session.Session(region_name=region, profile_name=profile)
+    if trace_file:
+        from .trace import tracer
+        tracer.start(trace_file, trace_format)
+        ctx.call_on_close(tracer.write)
     click.echo('')
     pass
-
-ncli.add_command(cf)
\ No newline at end of file
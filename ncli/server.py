@@ -0,0 +1,156 @@
+import importlib
+import json
+import os
+import socket
+import struct
+import sys
+import traceback
+
+import click
+
+from .daemon import commandPath, relevantEnv, socketPath, writeFrame
+
+# Forwarded commands that create AWS sessions, they can end up prompting for an MFA code
+session_commands = [('cf', 'sync'), ('cf', 'status'), ('cf', 'validate')]
+
+class SocketOutput(object):
+    """Stream that sends everything written to it to the client as frames of one kind"""
+
+    def __init__(self, connection, kind, tty):
+        self.connection = connection
+        self.kind = kind
+        self.tty = tty
+        self.encoding = 'utf-8'
+        self.errors = 'replace'
+
+    def write(self, text):
+        if text:
+            try:
+                writeFrame(self.connection, self.kind, text if isinstance(text, bytes) else text.encode('utf-8', 'replace'))
+            except OSError:
+                # The client went away, let the command finish anyway
+                pass
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+@click.command(short_help='Run the ncli daemon')
+@click.option('--socket', 'socket_path', help="Path of the unix socket  [default: $XDG_RUNTIME_DIR/ncli.sock]")
+@click.option('--idle-timeout', 'idle_timeout', default=1800, show_default=True, help="Seconds without commands before the daemon exits, 0 to run forever")
+def serve(socket_path, idle_timeout):
+    """Run a local daemon that keeps boto3, the AWS sessions, the config
+    files and the parsed templates warm between ncli invocations.
+
+    While it runs, commands that don't prompt (info, sync, validate...) are
+    forwarded to it by the ncli command; everything else, or everything when
+    the daemon isn't running, runs in process as usual. Set NCLI_NO_DAEMON=1
+    to never use the daemon."""
+    socket_path = socket_path or socketPath()
+    if not hasattr(socket, 'AF_UNIX'):
+        click.echo(click.style('The daemon needs unix sockets, which are not available in this platform', fg='red'))
+        exit(1)
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            click.echo(click.style('The daemon is already running on {}'.format(socket_path), fg='red'))
+            exit(1)
+        except OSError:
+            os.remove(socket_path)
+        finally:
+            probe.close()
+
+    # Pay the imports once, every forwarded command reuses them
+    importlib.import_module('boto3')
+    from .ncli import ncli
+    ncli.get_command(None, 'cf')
+
+    os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    previous_umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(previous_umask)
+    listener.listen(16)
+    listener.settimeout(idle_timeout or None)
+    click.echo(click.style('ncli daemon listening on {}'.format(socket_path), fg='green'))
+
+    try:
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except socket.timeout:
+                click.echo(click.style('No commands in {} seconds, exiting'.format(idle_timeout), fg='blue'))
+                break
+            # Commands run one at a time, they depend on the working directory and module level state
+            with connection:
+                _handle(ncli, connection)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def _handle(ncli, connection):
+    try:
+        request = json.loads(connection.makefile('rb').readline().decode('utf-8'))
+    except (OSError, ValueError):
+        return
+
+    if request.get('env') != relevantEnv(os.environ):
+        # The AWS settings of the client differ from the daemon's, the client runs it by itself
+        writeFrame(connection, b'f', b'')
+        return
+
+    if _mayPromptForMfa(request['argv']):
+        # The daemon has no terminal to read the MFA code from, the client runs it by itself
+        writeFrame(connection, b'f', b'')
+        return
+
+    cwd = os.getcwd()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = SocketOutput(connection, b'o', request.get('color', False))
+    sys.stderr = SocketOutput(connection, b'e', request.get('color', False))
+    code = 0
+    try:
+        os.chdir(request['cwd'])
+        ncli.main(args=request['argv'], prog_name='ncli', color=request.get('color') or None)
+    except SystemExit as ex:
+        code = ex.code if isinstance(ex.code, int) else (0 if ex.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(cwd)
+
+    try:
+        writeFrame(connection, b'x', struct.pack('!i', code))
+    except OSError:
+        pass
+
+def _mayPromptForMfa(argv):
+    """Checks if the command can use a profile with mfa_serial, the profile in the .config isn't known until it runs"""
+    if commandPath(argv) not in session_commands:
+        return False
+
+    import botocore.session
+    profiles = botocore.session.Session().full_config.get('profiles', {})
+    if '--profile' in argv[:-1]:
+        name = argv[argv.index('--profile') + 1]
+        seen = []
+        # Follow the source_profile chain, the MFA can be required by any of the roles
+        while name in profiles and name not in seen:
+            if profiles[name].get('mfa_serial'):
+                return True
+            seen.append(name)
+            name = profiles[name].get('source_profile')
+        return False
+    return any(profile.get('mfa_serial') for profile in profiles.values())
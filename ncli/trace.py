@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Error codes AWS uses when it throttles a request
+throttling_codes = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException',
+                    'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown', 'ProvisionedThroughputExceededException']
+
+class Tracer(object):
+    """Records the spans and AWS API counters of a command when --trace is given
+
+    Spans nest per thread and keep their wall and CPU time (of the thread that ran them). The
+    counters come from botocore event hooks installed in every session the tool creates.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.spans = []
+        self.api_calls = {}
+        self.counters = {'bytes_sent': 0, 'bytes_received': 0, 'retries': 0, 'throttles': 0}
+        self.started = time.time()
+        self.started_cpu = time.process_time()
+
+    def start(self, path, output_format='chrome'):
+        self.reset()
+        self.path = path
+        self.output_format = output_format
+        self.enabled = True
+
+    def record(self, name, started, wall, cpu, depth, args):
+        with self.lock:
+            self.spans.append({'name': name, 'start': started, 'wall': wall, 'cpu': cpu, 'tid': threading.get_ident(), 'depth': depth, 'args': args})
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] += value
+
+    def countCall(self, operation):
+        with self.lock:
+            self.api_calls[operation] = self.api_calls.get(operation, 0) + 1
+
+    def write(self):
+        """Writes the trace file and stops tracing"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        wall = time.time() - self.started
+        cpu = time.process_time() - self.started_cpu
+        output = chromeTrace(self, wall, cpu) if self.output_format == 'chrome' else summary(self, wall, cpu)
+        with open(self.path, 'w') as file:
+            json.dump(output, file, indent=2 if self.output_format == 'summary' else None)
+
+tracer = Tracer()
+
+@contextmanager
+def span(name, **args):
+    """Times the block as a span of the trace, does nothing when tracing is disabled"""
+    if not tracer.enabled:
+        yield
+        return
+    depth = getattr(tracer.local, 'depth', 0)
+    tracer.local.depth = depth + 1
+    started = time.time()
+    started_cpu = time.thread_time()
+    try:
+        yield
+    finally:
+        tracer.local.depth = depth
+        tracer.record(name, started, time.time() - started, time.thread_time() - started_cpu, depth, args)
+
+def instrumentSession(session):
+    """Counts the API calls, bytes, retries and throttles of the clients of a boto3 session,
+    it has to be called before creating them"""
+    events = session.events
+
+    def beforeCall(model, **kwargs):
+        if tracer.enabled:
+            tracer.countCall('{}.{}'.format(model.service_model.service_name, model.name))
+
+    def beforeSend(request, **kwargs):
+        if tracer.enabled:
+            # Streamed uploads (eg. S3 with checksums) are chunked and carry the real size apart
+            size = request.headers.get('X-Amz-Decoded-Content-Length') or request.headers.get('Content-Length')
+            tracer.count('bytes_sent', int(size or 0))
+
+    def afterCall(http_response, parsed, model, **kwargs):
+        if tracer.enabled:
+            size = http_response.headers.get('Content-Length')
+            if size is None and not model.has_streaming_output:
+                # Already read by the parser, streamed bodies are left for the caller to read
+                size = len(http_response.content)
+            tracer.count('bytes_received', int(size or 0))
+            tracer.count('retries', parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def needsRetry(response=None, **kwargs):
+        if tracer.enabled and response is not None and response[1].get('Error', {}).get('Code') in throttling_codes:
+            tracer.count('throttles')
+
+    events.register('before-call', beforeCall)
+    events.register('before-send', beforeSend)
+    events.register('after-call', afterCall)
+    events.register('needs-retry', needsRetry)
+
+def chromeTrace(tracer, wall, cpu):
+    """Returns the trace in the Chrome trace event format (chrome://tracing, Perfetto)"""
+    pid = os.getpid()
+    events = [{'name': 'ncli', 'ph': 'X', 'ts': 0, 'dur': int(wall * 1e6), 'pid': pid, 'tid': threading.main_thread().ident, 'args': {'cpu_ms': round(cpu * 1000, 3)}}]
+    for item in tracer.spans:
+        args = dict(item['args'], cpu_ms=round(item['cpu'] * 1000, 3))
+        events.append({'name': item['name'], 'ph': 'X', 'ts': int((item['start'] - tracer.started) * 1e6), 'dur': int(item['wall'] * 1e6), 'pid': pid, 'tid': item['tid'], 'args': args})
+    events.append({'name': 'aws', 'ph': 'C', 'ts': int(wall * 1e6), 'pid': pid, 'args': dict(tracer.counters, api_calls=sum(tracer.api_calls.values()))})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'api_calls': tracer.api_calls, 'counters': tracer.counters}}
+
+def summary(tracer, wall, cpu):
+    """Returns the totals of every span name and the counters"""
+    spans = {}
+    for item in tracer.spans:
+        total = spans.setdefault(item['name'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+        total['count'] += 1
+        total['wall_seconds'] += item['wall']
+        total['cpu_seconds'] += item['cpu']
+    return dict({
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'spans': spans,
+        'api_calls': tracer.api_calls,
+        'total_api_calls': sum(tracer.api_calls.values()),
+    }, **tracer.counters)
@@ -11,8 +11,12 @@ setup(
         'colorama',
         'pyperclip'
     ],
+    extras_require={
+        'cache': ['cryptography', 'keyring'],
+        'bench': ['moto[s3,cloudformation,ssm,secretsmanager]>=5'],
+    },
     entry_points='''
         [console_scripts]
-        ncli=ncli.ncli:ncli
+        ncli=ncli.daemon:main
     ''',
 )
\ No newline at end of file
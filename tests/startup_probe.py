@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+
+# Shared by test_startup.py and benchmarks/run.py, it doesn't depend on pytest
+
+repository_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be imported by `ncli --help` and `ncli cf info`, they cost hundreds of milliseconds
+lazy_modules = ['boto3', 'botocore', 'pyperclip']
+# Runs the command like the ncli entry point and prints the modules it imported
+probe = '''import json, sys
+from ncli.ncli import ncli
+try:
+    ncli.main(sys.argv[1:], prog_name='ncli')
+except SystemExit:
+    pass
+sys.stderr.write('\\n' + json.dumps(sorted(sys.modules)))
+'''
+
+def importedModules(argv, cwd):
+    """Returns the modules imported by running `ncli <argv>` in cwd, without the daemon"""
+    env = dict(os.environ, NCLI_NO_DAEMON='1', PYTHONPATH=repository_dir)
+    process = subprocess.run([sys.executable, '-c', probe] + argv, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return json.loads(process.stderr.decode('utf-8').strip().splitlines()[-1])
@@ -0,0 +1,9 @@
+import pytest
+
+from startup_probe import importedModules, lazy_modules
+
+@pytest.mark.parametrize('argv', [['--help'], ['cf', 'info']])
+def test_startup_import_budget(argv, tmp_path):
+    (tmp_path / '.config').write_text('global:\n  stack_name: budget\n  bucket: budget-bucket\n  region: us-east-1\n')
+    modules = importedModules(argv, str(tmp_path))
+    assert [module for module in lazy_modules if module in modules] == []